@@ -35,49 +35,41 @@ AboutPage = st.Page(
 )
 
 
-import requests
-import subprocess
-import time
+from Functions import ollama_manager
 status = st.sidebar.empty()
 container  = st.sidebar.empty()
-
-def is_ollama_running():
-    try:
-        response = requests.get("http://localhost:11434", timeout=2)
-        return response.status_code == 200
-    except requests.exceptions.RequestException:
-        return False
+manager = ollama_manager()
+MODELS = ["gemma3", "qwen2.5-coder:7b"]
 
 def start_ollama():
     try:
         with st.spinner("Starting Ollama..."):
-            subprocess.Popen(["ollama", "serve"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        
-        time.sleep(3)
-        st.session_state.status = "Online"  
+            ready = manager.start()
+        if ready:
+            st.session_state.status = "Online"
+        else:
+            status.error("Ollama did not become ready in time")
     except Exception as e:
             status.error("Failed to start Ollama:" + str(e))
 
-def list_installed_models():
-    try:
-        output = subprocess.check_output(["ollama", "list"], universal_newlines=True)
-        models = [line.split()[0] for line in output.strip().split("\n")[1:]]
-        return models
-    except subprocess.CalledProcessError as e:
-            container.error(f"Error listing models: {e}")
-            return []
-
 # --- Main logic ---
 if st.session_state.status is None:
-    if not is_ollama_running():
+    if not manager.is_running():
         st.session_state.status = "Offline"
         start_ollama()
     else:
         st.session_state.status = "Online"
-        models = list_installed_models()  
     
 if st.session_state.status == "Online":
     status.success("Ollama is running")
+    try:
+        # Preload the models in the background so the first answer skips the load time.
+        missing = [model for model in MODELS if not manager.has_model(model)]
+        manager.warm_up([model for model in MODELS if model not in missing])
+        if missing:
+            container.warning("Missing models: " + ", ".join(missing) + ". Install them with `ollama pull`.")
+    except Exception as e:
+            container.error(f"Error listing models: {e}")
     
 
 
@@ -93,41 +85,161 @@ if "df" not in st.session_state:
     st.session_state.df = None
 if "file" not in st.session_state:
     st.session_state.file = None  
+if "fingerprint" not in st.session_state:
+    st.session_state.fingerprint = None
+
+if "loader" not in st.session_state:
+    st.session_state.loader = None
+
+@st.fragment(run_every=1)
+def ingest_progress():
+    # Polls the background loader and swaps the preview sample for the full frame once it is done.
+    loader = st.session_state.loader
+    if loader.done:
+        st.session_state.loader = None
+        if loader.error is not None:
+            # Remembered so the same upload is not streamed again on every rerun, and the partial sample is dropped.
+            st.session_state.load_error = (loader.fingerprint, str(loader.error))
+            st.session_state.df = None
+            st.session_state.file = None
+            st.session_state.fingerprint = None
+            st.rerun()
+        from Shared import session_dataset
+        st.session_state.df = session_dataset(loader.fingerprint, lambda: loader.df)
+        st.session_state.fingerprint = loader.fingerprint
+        st.session_state.memory = loader.memory
+        st.session_state.sketch = (loader.fingerprint, loader.sketch)
+        st.rerun()
+    st.session_state.df = loader.sample
+    st.session_state.fingerprint = f"{loader.fingerprint}-sample{loader.rows}"
+    st.progress(loader.progress, text=f"Loaded {loader.rows:,} rows, previewing a {len(loader.sample):,} row sample")
 
 with st.sidebar:
-    uploaded_file = st.file_uploader("Upload a data file", type=["csv", "xlsx", "xls", "json", "txt", "tsv", "parquet"])
+    uploaded_file = st.file_uploader("Upload a data file", type=["csv", "xlsx", "xls", "json", "jsonl", "ndjson", "txt", "tsv", "parquet"])
 
     if uploaded_file is not None:
-        import pandas as pd
         from pathlib import Path
+        from Functions import setting
+        from Loader import (STREAMABLE, ChunkedLoader, DatasetCache, compact_dtypes, dataset_key,
+                            excel_sheets, file_fingerprint, parquet_columns, read_dataset, read_excel_sheets)
+        from Shared import session_dataset
 
         file_suffix = Path(uploaded_file.name).suffix.lower()
+        key = None
         try:
-            with st.spinner("Loading..."):
-                if file_suffix == ".csv":
-                    df = pd.read_csv(uploaded_file)
-                elif file_suffix in [".xlsx", ".xls"]:
-                    df = pd.read_excel(uploaded_file)
-                elif file_suffix == ".json":
-                    df = pd.read_json(uploaded_file)
-                elif file_suffix in [".txt", ".tsv"]:
-                    df = pd.read_csv(uploaded_file, delimiter="\t")
+            # Hash and inspect each upload once, not on every rerun.
+            if st.session_state.get("upload_id") != uploaded_file.file_id:
+                st.session_state.upload_id = uploaded_file.file_id
+                st.session_state.load_error = None
+                st.session_state.upload_hash = file_fingerprint(uploaded_file)
+                st.session_state.upload_parts = None
+                if file_suffix in [".xlsx", ".xls"]:
+                    st.session_state.upload_parts = excel_sheets(uploaded_file)
                 elif file_suffix == ".parquet":
-                    df = pd.read_parquet(uploaded_file)
-                else:
-                    st.error("Unsupported file format")
-                    df = None
-
-                if df is not None:
-                    st.session_state.df = df
-                    st.session_state.file = uploaded_file
+                    st.session_state.upload_parts = parquet_columns(uploaded_file)
+            fingerprint = st.session_state.upload_hash
+            parts = st.session_state.upload_parts
+
+            sheet = columns = None
+            if file_suffix in [".xlsx", ".xls"] and len(parts) > 1:
+                sheet = st.selectbox("Sheet", parts)
+            elif file_suffix == ".parquet":
+                columns = st.multiselect("Columns to load", parts, placeholder="All columns") or None
+            compact = st.toggle("Optimise memory", value=setting("ingest", "compact", True),
+                                help="Downcast numbers and store repeated text as categories")
+            key = dataset_key(fingerprint, sheet, columns, compact)
+
+            loader = st.session_state.loader
+            loading = loader is not None and loader.fingerprint == key
+            failed = st.session_state.get("load_error")
+            if failed is not None and failed[0] == key:
+                # A view of this upload that already failed is only tried again once a new file is uploaded.
+                st.error(f"Failed to read file: {failed[1]}")
+            elif key != st.session_state.fingerprint and not loading:
+                with st.spinner("Loading..."):
+                    cache = DatasetCache()
+                    # Another session may already hold this dataset in memory; it is shared, not loaded again.
+                    df = session_dataset(key, lambda: cache.load(key, arrow_strings=compact))
+                    memory = None
+                    stream = file_suffix in STREAMABLE and uploaded_file.size > setting("ingest", "stream_mb", 100) * 1024**2
+
+                    if df is None and stream:
+                        # Large text files: publish a sample now, finish the load in the background.
+                        loader = ChunkedLoader(uploaded_file, file_suffix, key, cache=cache, compact=compact).start()
+                        loader.first_chunk.wait()
+                        if loader.sample is not None:
+                            st.session_state.loader = loader
+                            st.session_state.df = loader.sample
+                            st.session_state.file = uploaded_file
+                            st.session_state.fingerprint = f"{key}-sample{loader.rows}"
+                            st.session_state.questions = None
+                        elif loader.error is not None:
+                            raise loader.error
+
+                    elif df is None and sheet is not None:
+                        # Parse every uncached sheet of the workbook at once, in parallel.
+                        pending = [name for name in parts if dataset_key(fingerprint, name, compact=compact) not in cache]
+                        frames = read_excel_sheets(uploaded_file, pending)
+                        for name, frame in frames.items():
+                            if compact:
+                                frame, before, after = compact_dtypes(frame)
+                                if name == sheet:
+                                    memory = (before, after)
+                            frames[name] = frame
+                            cache.save(dataset_key(fingerprint, name, compact=compact), frame)
+                        df = frames[sheet]
+
+                    elif df is None:
+                        df = read_dataset(uploaded_file, file_suffix, sheet=sheet, columns=columns)
+                        if compact:
+                            df, before, after = compact_dtypes(df)
+                            memory = (before, after)
+                        cache.save(key, df)
+
+                    if df is not None:
+                        st.session_state.loader = None
+                        st.session_state.df = session_dataset(key, lambda: df)
+                        st.session_state.file = uploaded_file
+                        st.session_state.fingerprint = key
+                        st.session_state.questions = None
+                        st.session_state.memory = memory or (None, int(df.memory_usage(deep=True).sum()))
 
         except Exception as e:
+            if key is not None:
+                st.session_state.load_error = (key, str(e))
             st.error(f"Failed to read file: {e}")
 
+    if st.session_state.loader is not None:
+        ingest_progress()
+    elif st.session_state.get("memory"):
+        before, after = st.session_state.memory
+        saved = f" (down from {before / 1024**2:,.1f} MB)" if before else ""
+        st.caption(f"Dataset memory: {after / 1024**2:,.1f} MB{saved}")
+
 
 st.logo("assets/logo.png", size='medium')
 with st.sidebar:
+    from Functions import code_cache, response_cache
+    cache_stats = response_cache().stats()
+    st.caption(f"LLM cache: {cache_stats['entries']:,} responses, {cache_stats['hits']:,} hits / "
+               f"{cache_stats['misses']:,} misses ({cache_stats['hit_rate']:.0%})")
+    from Memory import memory_panel
+    memory_panel()
+    from Shared import shared_store
+    shared_stats = shared_store().stats()
+    st.caption(f"Shared store: {shared_stats['datasets']:,} datasets, {shared_stats['entries']:,} items, "
+               f"{shared_stats['bytes'] / 1024**2:,.0f} MB across {shared_stats['sessions']:,} sessions")
+    code_stats = code_cache().stats()
+    st.caption(f"Code cache: {code_stats['entries']:,} snippets, {code_stats['hits']:,} hits / "
+               f"{code_stats['misses']:,} misses ({code_stats['hit_rate']:.0%})")
+    if st.session_state.get("df") is not None:
+        from Exports import bundle_download
+        bundle_download()
+    streams = st.session_state.get("stream_stats")
+    if streams:
+        ttft = sorted(stats.ttft for stats in streams)[len(streams) // 2]
+        speed = sorted(stats.tokens_per_second for stats in streams)[len(streams) // 2]
+        st.caption(f"LLM streams: {len(streams)}, median first token {ttft:.2f}s, {speed:.1f} tokens/s")
     st.caption("Support me by clicking on this button 👇")
     button(username="astrayn", floating=False, width=221)
     st.caption('0.0.3')
@@ -0,0 +1,140 @@
+import numpy as np
+
+FULL, BRIEF, NAME = 2, 1, 0
+MAX_VALUE_CHARS = 24
+TOP_VALUES = 3
+
+
+def estimate_tokens(text):
+    #Roughly four characters per token for the English/number mix these prompts contain.
+    return len(text) // 4 + 1
+
+
+def _short(value):
+    if isinstance(value, (float, np.floating)):
+        return _number(value)
+    text = str(value).replace("\n", " ")
+    return text if len(text) <= MAX_VALUE_CHARS else text[:MAX_VALUE_CHARS - 1] + "…"
+
+
+def _number(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return "nan"
+    return f"{value:.4g}"
+
+
+def rank_columns(stats):
+    """Order columns by how much they tell a model about the data.
+
+    Identifier-like and constant columns rank last, columns with missing
+    values and low-cardinality categoricals first; ties keep table order.
+    """
+    rows = max(stats.shape[0], 1)
+    scores = {}
+    for position, (name, info) in enumerate(stats.columns.iterrows()):
+        unique = info["unique"]
+        if unique <= 1 or (unique >= 0.95 * rows and name not in stats.numeric.index):
+            score = 0.0
+        else:
+            score = 1.0
+            score += 0.5 if info["nulls"] else 0
+            score += 0.5 if name not in stats.numeric.index and unique <= 50 else 0
+        scores[name] = (score, -position)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def _column_line(stats, name, level):
+    if level == NAME:
+        return None
+    info = stats.columns.loc[name]
+    line = f"- {name} | {info['dtype']} | nulls {info['nulls']:,} | unique {info['unique']:,}"
+    if level == FULL:
+        if name in stats.numeric.index:
+            s = stats.numeric.loc[name]
+            line += (f" | mean {_number(s['mean'])} std {_number(s['std'])} min {_number(s['min'])} "
+                     f"median {_number(s['50%'])} max {_number(s['max'])}")
+        elif stats.top_values.get(name) and stats.top_values[name][0][1] > 1:
+            # Top values of an all-distinct column are arbitrary, they are only listed when something repeats.
+            top = ", ".join(f"{_short(value)} ({count:,})" for value, count in stats.top_values[name][:TOP_VALUES])
+            line += f" | top {top}"
+    return line
+
+
+def build_context(stats, file_name, budget=1500, sections=()):
+    """Compact, deterministic description of a dataset that fits `budget` tokens.
+
+    Every column starts with full statistics; while the text is over budget
+    the lowest-ranked column is demoted to name/dtype/null/unique facts and
+    then to a bare name in a trailing list. Extra `sections` (title, text)
+    and the preview rows are only added if they still fit. The output only
+    depends on the statistics, so identical datasets give byte-identical
+    prompt prefixes that Ollama can reuse from its KV cache.
+    """
+    header = [
+        f"Dataset: {file_name}",
+        f"Rows: {stats.shape[0]:,} | Columns: {stats.shape[1]:,} | Duplicate rows: {stats.duplicates()}",
+    ]
+    if stats.error_bounds:
+        header.append(stats.approximation_note())
+    header.append("Columns (name | dtype | nulls | unique | summary):")
+
+    names = stats.columns.index.tolist()
+    levels = dict.fromkeys(names, FULL)
+    lines = {name: _column_line(stats, name, FULL) for name in names}
+    used = estimate_tokens("\n".join(header)) + sum(estimate_tokens(line) for line in lines.values())
+    for level in (BRIEF, NAME):
+        for name in reversed(rank_columns(stats)):
+            if used <= budget:
+                break
+            used -= estimate_tokens(lines[name])
+            lines[name] = _column_line(stats, name, level)
+            levels[name] = level
+            used += estimate_tokens(lines[name]) if lines[name] else estimate_tokens(str(name)) + 1
+        if used <= budget:
+            break
+
+    text = header + [lines[name] for name in names if levels[name] != NAME]
+    dropped = [str(name) for name in names if levels[name] == NAME]
+    if dropped:
+        text.append(f"Other columns ({len(dropped)}): " + ", ".join(dropped))
+
+    for title, body in sections:
+        block = f"{title}:\n{body}"
+        if used + estimate_tokens(block) <= budget:
+            text.append(block)
+            used += estimate_tokens(block)
+
+    preview = stats.head[[name for name in names if levels[name] != NAME]].map(_short)
+    block = "Sample rows:\n" + preview.to_csv(index=False).strip()
+    if len(preview.columns) and used + estimate_tokens(block) <= budget:
+        text.append(block)
+    return "\n".join(text)
+
+
+def correlation_context(pairs, budget=600):
+    """Strongest and weakest correlation pairs, as many as fit in `budget` tokens.
+
+    `pairs` is a frame with columns a, b and r; pairs are listed strongest
+    first, then the weakest ones, alternating so both ends stay represented.
+    """
+    if pairs is None or len(pairs) == 0:
+        return "No numeric column pairs."
+    ordered = pairs.reindex(pairs["r"].abs().sort_values(ascending=False).index)
+    strongest = ordered.itertuples(index=False)
+    weakest = ordered.iloc[::-1].itertuples(index=False)
+    high, low, seen, used = [], [], set(), 0
+    for pair in (item for both in zip(strongest, weakest) for item in both):
+        key = (pair.a, pair.b)
+        if key in seen:
+            continue
+        line = f"- {pair.a} ~ {pair.b}: {pair.r:+.2f}"
+        if used + estimate_tokens(line) > budget:
+            break
+        seen.add(key)
+        used += estimate_tokens(line)
+        (high if abs(pair.r) >= 0.5 else low).append((abs(pair.r), line))
+    high = [line for _, line in sorted(high, reverse=True)]
+    low = [line for _, line in sorted(low, reverse=True)]
+    return "Strongest correlations:\n" + ("\n".join(high) or "- none") + \
+        "\nWeakest correlations:\n" + ("\n".join(low) or "- none")
+
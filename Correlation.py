@@ -0,0 +1,180 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from Shared import shared_cache
+
+BLOCK_COLUMNS = 256
+TOP_PAIRS = 50
+HEATMAP_COLUMNS = 30
+
+
+def standardized(df, method="pearson", block=BLOCK_COLUMNS):
+    """Numeric columns as a float32 matrix whose column dot products are correlations.
+
+    Spearman ranks every column once up front, after which it is a Pearson
+    correlation of the ranks. Each column is centred and scaled over its
+    non-null values and missing cells become 0. Columns are standardized in
+    float64 one block at a time and only then stored as float32, so
+    large-magnitude columns (timestamps, ids) keep their precision.
+    Constant columns are dropped. Returns the column names, the matrix and,
+    when any cell is missing, a float32 mask of the present cells (else None).
+    """
+    numeric = df.select_dtypes(include=['number'])
+    if method == "spearman":
+        numeric = numeric.rank(method="average")
+    values = np.empty((len(numeric), numeric.shape[1]), dtype=np.float32)
+    present = None
+    keep = np.zeros(numeric.shape[1], dtype=bool)
+    for start in range(0, numeric.shape[1], block):
+        part = numeric.iloc[:, start:start + block].to_numpy(dtype=np.float64, na_value=np.nan)
+        stop = start + part.shape[1]
+        missing = np.isnan(part)
+        if missing.any() and present is None:
+            present = np.ones(values.shape, dtype=np.float32)
+        if present is not None:
+            present[:, start:stop] = ~missing
+        with np.errstate(invalid="ignore", divide="ignore"):
+            count = np.sum(~missing, axis=0)
+            part -= np.nanmean(part, axis=0)
+            norm = np.sqrt(np.nansum(np.square(part), axis=0))
+            part /= norm
+        keep[start:stop] = (count > 1) & (norm > 0)
+        values[:, start:stop] = np.nan_to_num(part, nan=0.0, posinf=0.0, neginf=0.0)
+    return numeric.columns[keep], values[:, keep], None if present is None else present[:, keep]
+
+
+def _block_correlation(left, right, left_present=None, right_present=None):
+    """Correlations between two column blocks, each pair over the rows where both values are present.
+
+    Without missing cells this is one product of the standardized blocks;
+    otherwise the pair counts, sums and sums of squares over the shared
+    rows come from five more products, as pandas' pairwise deletion does.
+    """
+    if left_present is None:
+        return np.clip(left.T @ right, -1, 1)
+    n = left_present.T @ right_present
+    sum_left = left.T @ right_present
+    sum_right = left_present.T @ right
+    sum_left2 = np.square(left).T @ right_present
+    sum_right2 = left_present.T @ np.square(right)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        covariance = n * (left.T @ right) - sum_left * sum_right
+        scale = np.sqrt((n * sum_left2 - sum_left ** 2) * (n * sum_right2 - sum_right ** 2))
+        r = np.where((n > 1) & (scale > 0), covariance / scale, np.nan)
+    return np.clip(r, -1, 1)
+
+
+def _upper_pairs(block, rows, cols, same):
+    #Flattened (row, col, r) of one correlation block, only above the diagonal when it is a diagonal block.
+    i, j = np.triu_indices(block.shape[0], 1, block.shape[1]) if same else np.indices(block.shape).reshape(2, -1)
+    return rows[i], cols[j], block[i, j]
+
+
+def _keep(candidates, k, strongest):
+    a, b, r = (np.concatenate(part) for part in zip(*candidates))
+    key = -np.abs(r) if strongest else np.abs(r)
+    if len(r) > k:
+        top = np.argpartition(key, k)[:k]
+        a, b, r = a[top], b[top], r[top]
+    return [(a, b, r)]
+
+
+@dataclass
+class CorrelationResult:
+    """Top-k strongest and weakest column pairs of one correlation method.
+
+    `strongest` and `weakest` are (a, b, r) frames sorted by |r|; the full
+    matrix is never held, so this scales to thousands of columns.
+    """
+    method: str
+    columns: list
+    strongest: pd.DataFrame
+    weakest: pd.DataFrame
+
+    def pairs(self):
+        return pd.concat([self.strongest, self.weakest]).drop_duplicates(["a", "b"]).reset_index(drop=True)
+
+
+def correlate(df, method="pearson", top_k=TOP_PAIRS, block=BLOCK_COLUMNS):
+    """Blocked float32 correlation of every numeric column pair, reduced to the top-k pairs.
+
+    Column blocks are multiplied pairwise with BLAS, and each block only
+    contributes its own k strongest and k weakest pairs before the next one
+    is computed. Pairs are correlated over the rows where both values are
+    present; Spearman ranks each column over all its values, where pandas
+    re-ranks per pair. Kendall has no such shortcut and goes through pandas.
+    """
+    if method == "kendall":
+        corr = df.corr(method="kendall", numeric_only=True)
+        values = corr.to_numpy()
+        i, j = np.triu_indices_from(values, 1)
+        names = corr.columns.to_numpy()
+        pairs = [(i, j, values[i, j])]
+    else:
+        names, values, present = standardized(df, method)
+        names = names.to_numpy()
+        strong, weak = [], []
+        for start in range(0, len(names), block):
+            left = values[:, start:start + block]
+            left_present = None if present is None else present[:, start:start + block]
+            rows = np.arange(start, start + left.shape[1])
+            for other in range(start, len(names), block):
+                right = values[:, other:other + block]
+                right_present = None if present is None else present[:, other:other + block]
+                cols = np.arange(other, other + right.shape[1])
+                pairs = _upper_pairs(_block_correlation(left, right, left_present, right_present),
+                                     rows, cols, other == start)
+                strong = _keep(strong + [pairs], top_k, True)
+                weak = _keep(weak + [pairs], top_k, False)
+        pairs = strong + weak if strong else [(np.empty(0, int), np.empty(0, int), np.empty(0))]
+    frames = []
+    for a, b, r in pairs:
+        frames.append(pd.DataFrame({"a": names[a], "b": names[b], "r": r.astype(np.float64)}).dropna())
+    strongest = frames[0].reindex(frames[0]["r"].abs().sort_values(ascending=False).index).head(top_k)
+    weakest = frames[-1].reindex(frames[-1]["r"].abs().sort_values().index).head(top_k)
+    return CorrelationResult(method, list(names), strongest.reset_index(drop=True), weakest.reset_index(drop=True))
+
+
+def correlation_matrix(df, columns, method="pearson"):
+    #Dense matrix for a handful of columns, e.g. the ones shown in a heatmap, with pandas' pairwise deletion.
+    corr = df[list(columns)].corr(method=method)
+    # Constant columns correlate with nothing, not even themselves.
+    return corr.dropna(how="all").dropna(axis=1, how="all")
+
+
+def heatmap_columns(result, limit=HEATMAP_COLUMNS):
+    #All columns when they fit, otherwise the ones taking part in the strongest pairs.
+    if len(result.columns) <= limit:
+        return result.columns
+    chosen = dict.fromkeys(np.ravel(result.strongest[["a", "b"]].to_numpy()))
+    return list(chosen)[:limit]
+
+
+def cluster_order(corr):
+    #Reorders rows and columns so correlated groups sit next to each other (average linkage on 1 - |r|).
+    if len(corr) < 3:
+        return corr
+    from scipy.cluster.hierarchy import leaves_list, linkage
+    from scipy.spatial.distance import squareform
+    distance = 1 - np.abs(np.nan_to_num(corr.to_numpy()))
+    np.fill_diagonal(distance, 0)
+    order = leaves_list(linkage(squareform(distance, checks=False), method="average"))
+    return corr.iloc[order, order]
+
+
+@shared_cache("correlations", show_spinner="Computing correlations...")
+def correlation_result(fingerprint, _df, method="pearson", top_k=TOP_PAIRS):
+    #Memoized per dataset fingerprint and method, the frame itself is never hashed.
+    return correlate(_df, method, top_k)
+
+
+@shared_cache("heatmap", show_spinner="Clustering correlations...")
+def heatmap_matrix(fingerprint, _df, method="pearson", limit=HEATMAP_COLUMNS):
+    """Clustered correlation matrix of at most `limit` columns and the total column count."""
+    result = correlation_result(fingerprint, _df, method)
+    columns = heatmap_columns(result, limit)
+    if len(columns) < 2:
+        return pd.DataFrame(), len(result.columns)
+    return cluster_order(correlation_matrix(_df, columns, method)), len(result.columns)
@@ -0,0 +1,169 @@
+import base64
+import gzip
+import html
+import os
+import shutil
+import tempfile
+import weakref
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+import streamlit as st
+
+BUNDLE_NAME = "zeno_export.zip"
+COPY_BUFFER = 1024**2
+
+
+class SessionExports:
+    """Downloadable artifacts of one session, kept in a private temp directory.
+
+    Artifacts are written straight to disk (or hard-linked from the stores
+    that already hold them) and compressed file to file, so a large profile
+    report never sits in memory next to its download. The directory is
+    removed when the session state is dropped.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = Path(tempfile.mkdtemp(prefix="zeno-exports-", dir=directory))
+        self._cleanup = weakref.finalize(self, shutil.rmtree, str(self.directory), True)
+        self.bundle_job = None
+        self._compressed = {}
+
+    def path(self, name):
+        return self.directory / name
+
+    def files(self):
+        #Every finished artifact, without compressed copies or the bundle itself.
+        return sorted(p for p in self.directory.iterdir()
+                      if p.is_file() and p.suffix not in (".gz", ".tmp") and p.name != BUNDLE_NAME)
+
+    def add_file(self, name, source):
+        """Expose a file under `name`, linked when possible so it is not copied."""
+        path = self.path(name)
+        if path.exists() and path.samefile(source):
+            return path
+        path.unlink(missing_ok=True)
+        try:
+            os.link(source, path)
+        except OSError:
+            shutil.copyfile(source, path)
+        return path
+
+    def add_figure(self, name, fig):
+        # Written beside and moved into place, so a new figure is a new file for gzipped().
+        path = self.path(name)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as file:
+            fig.write_html(file)
+        os.replace(tmp, path)
+        return path
+
+    def add_transcript(self, messages, name="chat_transcript.html"):
+        """Chat messages as one HTML page, with their Plotly figures, images and tables inline."""
+        import plotly.io as pio
+        from plotly.offline import get_plotlyjs
+
+        path = self.path(name)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("<!DOCTYPE html><html><head><meta charset='utf-8'><title>Chat transcript</title>")
+            file.write(f"<script>{get_plotlyjs()}</script></head><body>")
+            for msg in messages:
+                file.write(f"<h3>{html.escape(msg['role'].capitalize())}</h3>")
+                if msg["role"] == "user":
+                    file.write(f"<p>{html.escape(msg['content'])}</p>")
+                    continue
+                file.write(f"<pre><code>{html.escape(msg.get('code') or '')}</code></pre>")
+                if msg.get("output"):
+                    file.write(f"<pre>{html.escape(msg['output'])}</pre>")
+                for method, args, kwargs in msg.get("st_calls") or []:
+                    for arg in args[:1]:
+                        if method == "plotly_chart":
+                            file.write(pio.to_html(arg, full_html=False, include_plotlyjs=False))
+                        elif method == "image" and isinstance(arg, bytes):
+                            # Matplotlib figures are stored as PNG by ChatHistory.
+                            file.write(f"<img src='data:image/png;base64,{base64.b64encode(arg).decode()}'>")
+                        elif isinstance(arg, (pd.DataFrame, pd.Series)):
+                            file.write(pd.DataFrame(arg).to_html(max_rows=100))
+                        else:
+                            file.write(f"<p>{html.escape(str(arg))}</p>")
+                if msg.get("error"):
+                    file.write(f"<pre style='color: red'>{html.escape(msg['error'])}</pre>")
+            file.write("</body></html>")
+        return path
+
+    def gzipped(self, path):
+        """Gzip of an artifact, compressed in 1 MB pieces and reused while the artifact is unchanged.
+
+        Artifacts are only ever replaced, never rewritten in place, so the
+        inode and size identify a version; mtime does not, the stores touch
+        it as their LRU clock.
+        """
+        path = Path(path)
+        target = path.with_name(path.name + ".gz")
+        stat = path.stat()
+        stamp = (stat.st_ino, stat.st_size)
+        if not target.exists() or self._compressed.get(target) != stamp:
+            tmp = target.with_name(target.name + ".tmp")
+            with open(path, "rb") as src, gzip.open(tmp, "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, COPY_BUFFER)
+            os.replace(tmp, target)
+            self._compressed[target] = stamp
+        return target
+
+    def _write_bundle(self, messages):
+        if messages:
+            self.add_transcript(messages)
+        target = self.path(BUNDLE_NAME)
+        tmp = target.with_name(target.name + ".tmp")
+        with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6) as bundle:
+            for path in self.files():
+                bundle.write(path, path.name)
+        os.replace(tmp, target)
+        return target
+
+    def start_bundle(self, messages=None):
+        """Zip every artifact (and the chat transcript) on a background thread."""
+        if self.bundle_job is None or self.bundle_job.done():
+            self.path(BUNDLE_NAME).unlink(missing_ok=True)
+            self.bundle_job = export_pool().submit(self._write_bundle, messages)
+        return self.bundle_job
+
+
+@st.cache_resource
+def export_pool():
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="export")
+
+
+def session_exports():
+    if "exports" not in st.session_state:
+        st.session_state.exports = SessionExports()
+    return st.session_state.exports
+
+
+@st.fragment(run_every=1)
+def bundle_progress(job):
+    if job.done():
+        st.rerun()
+    st.caption("Building bundle...")
+
+
+def bundle_download():
+    #Sidebar control: builds the bundle in the background and offers it once it is on disk.
+    exports = session_exports()
+    job = exports.bundle_job
+    if st.button("Prepare export bundle", disabled=job is not None and not job.done(),
+                 help="Zips the profile report, downloaded plots and the chat transcript"):
+        history = st.session_state.get("history")
+        # Decoded here, the history may spill payloads while the export thread writes.
+        job = exports.start_bundle(list(history.messages()) if history is not None and len(history) else None)
+    if job is None:
+        return
+    if not job.done():
+        bundle_progress(job)
+    elif job.exception() is not None:
+        st.error(f"Export failed: {job.exception()}")
+    else:
+        with open(job.result(), "rb") as file:
+            st.download_button("Download bundle", data=file, file_name=BUNDLE_NAME, mime="application/zip")
@@ -1,24 +1,399 @@
 import streamlit as st
 import ollama
+import asyncio
+import json
+import multiprocessing
+import re
+import subprocess
+import sys
+import threading
+import time
+import types
+from concurrent.futures import Future, ProcessPoolExecutor
 
-@st.cache_data
-def callOllama(prompt, model="gemma3"):
-    #Call the Ollama API with the given prompt.
-    response = ollama.chat(
+from Shared import shared_cache
+
+def setting(section, key, default):
+    #Read an optional tuning value from .streamlit/secrets.toml, falling back to the default.
+    try:
+        return st.secrets.get(section, {}).get(key, default)
+    except Exception:
+        return default
+
+class SpawnPool(ProcessPoolExecutor):
+    """Spawn-based process pool whose workers do not re-run the page that started them.
+
+    Streamlit executes each page as `__main__`, and a spawned child imports
+    the parent's `__main__` file before anything else. Workers are started
+    inside submit(), so `__main__` is swapped for an empty module there.
+    """
+    _main_lock = threading.Lock()
+
+    def __init__(self, max_workers, initializer=None):
+        super().__init__(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"),
+                         initializer=initializer)
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._main_lock:
+            main = sys.modules["__main__"]
+            sys.modules["__main__"] = types.ModuleType("__main__")
+            try:
+                return super().submit(fn, *args, **kwargs)
+            finally:
+                sys.modules["__main__"] = main
+
+def keep_alive_seconds(keep_alive):
+    #Ollama's keep_alive in seconds: a number of seconds or a duration like "30m" or "1h30m"; negative never expires.
+    if isinstance(keep_alive, (int, float)) or re.fullmatch(r"-?\d+(\.\d+)?", str(keep_alive)):
+        seconds = float(keep_alive)
+    else:
+        units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", str(keep_alive))
+        seconds = sum(float(value) * units[unit] for value, unit in parts)
+        if str(keep_alive).startswith("-"):
+            seconds = -seconds
+    return float("inf") if seconds < 0 else seconds
+
+class OllamaManager:
+    """Process-wide owner of the Ollama server connection.
+
+    Holds one pooled HTTP client for every call site, starts `ollama serve`
+    when needed and polls readiness with exponential backoff, caches the
+    installed model list, and preloads models in the background with
+    `keep_alive` so the first real request does not pay the load time.
+    Readiness and model list requests give up after `probe_timeout` seconds.
+    """
+
+    def __init__(self, host=None, keep_alive="30m", models_ttl=60, probe_timeout=2):
+        self.host = host
+        self.keep_alive = keep_alive
+        self.models_ttl = models_ttl
+        self.client = ollama.Client(host)
+        # A separate client, generations legitimately take longer than a probe may.
+        self._probe = ollama.Client(host, timeout=probe_timeout)
+        self._models = None
+        self._models_checked = 0
+        self._warming = {}
+        self._warmed = {}
+        self._lock = threading.Lock()
+
+    def is_running(self):
+        try:
+            self.models(refresh=True)
+            return True
+        except Exception:
+            return False
+
+    def wait_ready(self, timeout=30, delay=0.1, max_delay=2.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.is_running():
+                return True
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+        return False
+
+    def start(self, timeout=30):
+        if self.is_running():
+            return True
+        subprocess.Popen(["ollama", "serve"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return self.wait_ready(timeout)
+
+    def models(self, refresh=False):
+        #Installed model names, re-fetched at most every models_ttl seconds.
+        with self._lock:
+            if not refresh and self._models is not None and time.monotonic() - self._models_checked <= self.models_ttl:
+                return list(self._models)
+        # Fetched outside the lock, so a slow server does not hold up every other session.
+        models = [m.model for m in self._probe.list().models]
+        with self._lock:
+            self._models = models
+            self._models_checked = time.monotonic()
+        return list(models)
+
+    def has_model(self, name):
+        tag = name if ":" in name else f"{name}:latest"
+        return any(model in (name, tag) for model in self.models())
+
+    def warm_up(self, models):
+        #Load each installed model again whenever its keep_alive window has run out, on a background thread.
+        window = keep_alive_seconds(self.keep_alive)
+        for model in models:
+            with self._lock:
+                state = self._warming.get(model)
+                if state == "loading" or (state == "ready" and time.monotonic() - self._warmed[model] < window):
+                    continue
+                self._warming[model] = "loading"
+            threading.Thread(target=self._load, args=(model,), daemon=True).start()
+
+    def _load(self, model):
+        try:
+            # An empty prompt only loads the model into memory.
+            self.client.generate(model=model, prompt="", keep_alive=self.keep_alive)
+            self._warmed[model] = time.monotonic()
+            self._warming[model] = "ready"
+        except Exception:
+            self._warming[model] = "failed"
+
+    def status(self, model):
+        return self._warming.get(model)
+
+@st.cache_resource
+def ollama_manager():
+    return OllamaManager(
+        host=setting("ollama", "host", None),
+        keep_alive=setting("ollama", "keep_alive", "30m"),
+    )
+
+@st.cache_resource
+def response_cache():
+    #Process-wide handle on the persistent response cache, shared by every session.
+    from LLMCache import ResponseCache
+    return ResponseCache(
+        ttl=setting("llm_cache", "ttl_hours", 168) * 3600,
+        max_entries=setting("llm_cache", "max_entries", 5000),
+        max_bytes=setting("llm_cache", "max_mb", 256) * 1024**2,
+    )
+
+@st.cache_resource
+def code_cache():
+    """Process-wide semantic cache of generated code.
+
+    Questions are embedded with the configured Ollama embedding model when
+    it is installed, otherwise with a local hashed bag-of-words stand-in.
+    """
+    from LLMCache import CodeCache, hashed_embedding
+    model = setting("code_cache", "embedding_model", "nomic-embed-text")
+    embed, embedder = hashed_embedding, "hashed"
+    try:
+        if model and ollama_manager().has_model(model):
+            manager = ollama_manager()
+            embed = lambda text: manager.client.embed(model=model, input=text, keep_alive=manager.keep_alive).embeddings[0]
+            embedder = model
+    except Exception:
+        pass
+    return CodeCache(
+        embed=embed,
+        embedder=embedder,
+        threshold=setting("code_cache", "threshold", 0.85),
+        ttl=setting("code_cache", "ttl_hours", 720) * 3600,
+        max_entries=setting("code_cache", "max_entries", 2000),
+    )
+
+def approximate_mode(fingerprint, rows):
+    #Whether this session describes the dataset from sketches: the Overview toggle once used, else [stats] approx_rows.
+    mode = st.session_state.get("stats_mode")
+    if mode is not None and mode[0] == fingerprint:
+        return mode[1]
+    return rows > setting("stats", "approx_rows", 5_000_000)
+
+def dataset_summary(fingerprint, df, approximate):
+    #(stats, outliers) of a dataset in one statistics mode, shared by every page and session.
+    from Outliers import outlier_report
+    from Stats import approximate_stats, dataset_stats
+    if approximate:
+        sketch = st.session_state.get("sketch")
+        stats = approximate_stats(fingerprint, df, sketch[1] if sketch and sketch[0] == fingerprint else None)
+    else:
+        stats = dataset_stats(fingerprint, df)
+    outliers = outlier_report(fingerprint, df, stats, approximate, setting("outliers", "mad_threshold", 3.5),
+                              setting("outliers", "isolation_threshold", 0.75))
+    return stats, outliers
+
+def dataset_context(fingerprint, df, file_name, approximate):
+    """Dataset description every LLM prompt opens with.
+
+    Built once per dataset and statistics mode, so the Overview and the
+    chatbot send byte-identical prefixes and Ollama reuses its KV cache
+    from one page to the other.
+    """
+    return _dataset_context(fingerprint, file_name, approximate, setting("context", "tokens", 1500), df)
+
+@shared_cache("context")
+def _dataset_context(fingerprint, file_name, approximate, tokens, _df):
+    from Context import build_context
+    stats, outliers = dataset_summary(fingerprint, _df, approximate)
+    sections = [("Outliers", outliers.to_context())] if outliers is not None else []
+    return build_context(stats, file_name, tokens, sections)
+
+def callOllama(prompt, model="gemma3", options=None, format=None):
+    #Call the Ollama API with the given prompt, answering from the persistent cache when possible.
+    cache = response_cache()
+    cached = cache.get(model, prompt, options, format)
+    if cached is not None:
+        return cached
+    manager = ollama_manager()
+    response = manager.client.chat(
         model=model,
-        messages=[{'role': 'user', 'content': prompt}]
+        messages=[{'role': 'user', 'content': prompt}],
+        options=options,
+        format=format,
+        keep_alive=manager.keep_alive
     )
-    return response.get('message', {}).get('content', "No response.")
+    content = response.get('message', {}).get('content', "No response.")
+    cache.put(model, prompt, content, options, format)
+    return content
+
+def stream_ollama(prompt, model="gemma3", options=None):
+    #Streaming variant of callOllama; a cached response is yielded as a single CachedChunk.
+    from Streaming import CachedChunk
+    cache = response_cache()
+    cached = cache.get(model, prompt, options)
+    if cached is not None:
+        yield CachedChunk(cached)
+        return
+    content = ""
+    manager = ollama_manager()
+    for chunk in manager.client.chat(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        stream=True,
+        options=options,
+        keep_alive=manager.keep_alive
+    ):
+        content += chunk["message"]["content"]
+        yield chunk["message"]["content"]
+    cache.put(model, prompt, content, options)
+
+class ConcurrentOllama:
+    """Runs chat requests on the Ollama async client from a private event loop.
+
+    `submit` returns a concurrent.futures.Future right away, so a page can
+    start several generations, keep rendering, and collect results as they
+    finish. At most `max_concurrency` requests are in flight; the Ollama
+    server itself only runs them side by side when OLLAMA_NUM_PARALLEL allows.
+    A request identical to one still in flight (a rerun while generating, or
+    another session) gets the same future instead of a second generation.
+    """
+
+    def __init__(self, max_concurrency=2, host=None, keep_alive=None):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.client = ollama.AsyncClient(host)
+        self.keep_alive = keep_alive
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    async def _chat(self, prompt, model, options, format, cache):
+        async with self.semaphore:
+            response = await self.client.chat(
+                model=model,
+                messages=[{'role': 'user', 'content': prompt}],
+                options=options,
+                format=format,
+                keep_alive=self.keep_alive
+            )
+        content = response.get('message', {}).get('content', "No response.")
+        await self.loop.run_in_executor(None, cache.put, model, prompt, content, options, format)
+        return content
+
+    def submit(self, prompt, model="gemma3", options=None, format=None):
+        from LLMCache import ResponseCache
+        key = ResponseCache.key(model, prompt, options, format)
+        with self._lock:
+            future = self._inflight.get(key)
+        if future is not None:
+            return future
+        cache = response_cache()
+        cached = cache.get(model, prompt, options, format)
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            future.cached = True
+            return future
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = asyncio.run_coroutine_threadsafe(self._chat(prompt, model, options, format, cache), self.loop)
+                future.cached = False
+                self._inflight[key] = future
+        # Dropped once finished, later requests are answered by the response cache.
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return future
+
+@st.cache_resource
+def concurrent_ollama():
+    manager = ollama_manager()
+    return ConcurrentOllama(
+        max_concurrency=setting("ollama", "max_concurrency", 2),
+        host=manager.host,
+        keep_alive=manager.keep_alive,
+    )
+
+def submit_ollama(prompt, model="gemma3", options=None, format=None):
+    #Non-blocking callOllama, returns a Future with the response text; `future.cached` tells a cache hit.
+    return concurrent_ollama().submit(prompt, model, options, format)
+
+QUESTIONS_SCHEMA = {
+    "type": "object",
+    "properties": {"questions": {"type": "array", "items": {"type": "string"}}},
+    "required": ["questions"],
+}
+
+CODE_ANSWERS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "answers": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"index": {"type": "integer"}, "code": {"type": "string"}},
+                "required": ["index", "code"],
+            },
+        }
+    },
+    "required": ["answers"],
+}
+
+def extract_code(text):
+    #Pull the code out of a ```python fenced reply; unfenced replies are returned as they are.
+    match = re.search(r"```(?:python|py)?[ \t]*\n(.*?)```", text, re.S)
+    return (match.group(1) if match else text).strip()
+
+def parse_questions(response):
+    #Questions of a QUESTIONS_SCHEMA reply, [] when it does not parse.
+    try:
+        data = json.loads(response)
+        items = data.get("questions", []) if isinstance(data, dict) else data
+    except ValueError:
+        return []
+    if not isinstance(items, list):
+        return []
+    return [str(item).strip() for item in items if str(item).strip()]
+
+def parse_code_answers(response, count):
+    """Validate a batched CODE_ANSWERS_SCHEMA reply item by item.
+
+    Returns a list with one entry per question: the code when it parsed and
+    compiled, else None so the caller can regenerate just that answer.
+    """
+    codes = [None] * count
+    try:
+        answers = json.loads(response).get("answers", [])
+    except (ValueError, AttributeError):
+        return codes
+    for answer in answers if isinstance(answers, list) else []:
+        if not isinstance(answer, dict):
+            continue
+        index, code = answer.get("index"), answer.get("code")
+        if not isinstance(index, int) or not 0 <= index < count or not isinstance(code, str):
+            continue
+        code = extract_code(code)
+        try:
+            compile(code, f"<answer {index}>", "exec")
+        except SyntaxError:
+            continue
+        codes[index] = code
+    return codes
 
 @st.cache_data
-def question():
+def question(file_name, columns):
     prompt = f"""Based on the following info extracted from a data set, write intersting questions 
-    a data analyst can plot, present your output only in the following format:
-    ['Question1', 'Question2', 'Question3']
-    also do not use apostropes in the output.
-    eg: ['What is the average age of customers?', 'How many unique products are sold?']
+    a data analyst can plot. Reply with a JSON object whose "questions" field lists the questions.
+    eg: {{"questions": ["What is the average age of customers?", "How many unique products are sold?"]}}
     
-    Data Name: {st.session_state.file.name}
-    Columns: {st.session_state.df.columns.tolist()} """
-    response = callOllama(prompt, model="gemma3")
-    return response
+    Data Name: {file_name}
+    Columns: {columns} """
+    response = callOllama(prompt, model="gemma3", format=QUESTIONS_SCHEMA)
+    return parse_questions(response)
@@ -0,0 +1,144 @@
+import io
+import pickle
+import shutil
+import tempfile
+import weakref
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import streamlit as st
+
+INLINE_TYPES = (str, int, float, bool, type(None))
+
+
+class ChatHistory:
+    """Chat messages with their recorded st.* calls serialized once.
+
+    Figures are kept as Plotly JSON, frames as Arrow (Feather) bytes and
+    matplotlib figures as PNG; only small values stay as Python objects.
+    Payloads live in memory until the session's history exceeds
+    `max_bytes`, then the oldest ones are written to a private temp
+    directory and read back only when their message is shown again.
+    """
+
+    def __init__(self, max_bytes=64 * 1024**2, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = Path(tempfile.mkdtemp(prefix="zeno-chat-", dir=directory))
+        self._cleanup = weakref.finalize(self, shutil.rmtree, str(self.directory), True)
+        self.records = []
+        self._memory = {}
+        self._spilled = {}
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def memory_bytes(self):
+        return sum(len(data) for data in self._memory.values())
+
+    @property
+    def disk_bytes(self):
+        return sum(self._spilled.values())
+
+    def add_user(self, content):
+        self.records.append({"role": "user", "content": content})
+
+    def add_assistant(self, content, code, output, calls, error):
+        encoded = [(method, [self._encode(arg) for arg in args],
+                    {name: self._encode(value) for name, value in kwargs.items()})
+                   for method, args, kwargs in calls]
+        self.records.append({"role": "assistant", "content": content, "code": code, "output": output,
+                             "calls": encoded, "error": error})
+        self._spill()
+
+    def _encode(self, value):
+        if isinstance(value, INLINE_TYPES):
+            return "inline", value
+        kind, data = "pickle", None
+        if hasattr(value, "to_plotly_json"):
+            kind, data = "plotly", value.to_json().encode()
+        elif isinstance(value, (pd.DataFrame, pd.Series)):
+            try:
+                buffer = io.BytesIO()
+                feather.write_feather(value.to_frame() if isinstance(value, pd.Series) else value, buffer,
+                                      compression="uncompressed")
+                kind, data = "arrow", buffer.getvalue()
+            except Exception:
+                # Mixed-type object columns cannot be expressed in Arrow.
+                pass
+        elif hasattr(value, "savefig"):
+            buffer = io.BytesIO()
+            value.savefig(buffer, format="png", bbox_inches="tight")
+            kind, data = "png", buffer.getvalue()
+        if data is None:
+            try:
+                data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                return "inline", str(value)
+        self._next_id += 1
+        self._memory[self._next_id] = data
+        return kind, self._next_id
+
+    def spill_all(self):
+        #Every payload held now to disk; later messages stay in memory up to max_bytes again.
+        self._spill(0)
+
+    def _spill(self, limit=None):
+        # Oldest payloads go to disk first, the newest messages stay in memory.
+        limit = self.max_bytes if limit is None else limit
+        total = self.memory_bytes
+        for payload in sorted(self._memory):
+            if total <= limit:
+                break
+            data = self._memory[payload]
+            (self.directory / str(payload)).write_bytes(data)
+            self._spilled[payload] = len(data)
+            del self._memory[payload]
+            total -= len(data)
+
+    def _payload(self, payload):
+        data = self._memory.get(payload)
+        return data if data is not None else (self.directory / str(payload)).read_bytes()
+
+    def _decode(self, encoded):
+        kind, value = encoded
+        if kind == "inline":
+            return value
+        data = self._payload(value)
+        if kind == "plotly":
+            import plotly.io as pio
+            return pio.from_json(data.decode())
+        if kind == "arrow":
+            return feather.read_table(pa.BufferReader(data)).to_pandas()
+        if kind == "png":
+            return data
+        return pickle.loads(data)
+
+    def calls(self, record):
+        """Decoded (method, args, kwargs) of an assistant message, as recorded by StreamlitCallRecorder."""
+        for method, args, kwargs in record.get("calls", []):
+            args = [self._decode(arg) for arg in args]
+            kwargs = {name: self._decode(value) for name, value in kwargs.items()}
+            if method == "pyplot" and args and isinstance(args[0], bytes):
+                # Stored as PNG, shown as an image.
+                method, kwargs = "image", {}
+            yield method, args, kwargs
+
+    def messages(self):
+        """Messages in the shape the page used to keep them, decoded one at a time."""
+        records = list(self.records)
+        for record in records:
+            if record["role"] == "user":
+                yield record
+            else:
+                yield {**record, "st_calls": list(self.calls(record))}
+
+
+def chat_history():
+    if "history" not in st.session_state:
+        from Functions import setting
+        st.session_state.history = ChatHistory(int(setting("chat", "memory_mb", 64) * 1024**2))
+    return st.session_state.history
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+CACHE_PATH = Path("outputs/llm_cache.sqlite3")
+EMBEDDING_DIM = 512
+
+
+def normalize_prompt(prompt):
+    #Prompts built from f-strings differ only in indentation and line breaks, so whitespace is collapsed.
+    return " ".join(prompt.split())
+
+
+@contextmanager
+def connect(path):
+    # One short-lived connection per call keeps this safe across Streamlit's script threads.
+    db = sqlite3.connect(path, timeout=10)
+    try:
+        with db:
+            yield db
+    finally:
+        db.close()
+
+
+class ResponseCache:
+    """Persistent LLM response cache shared by every session and restart.
+
+    Entries are keyed on model, normalised prompt, generation options and
+    the structured-output format, if any.
+    They expire after `ttl` seconds, and the least recently used ones are
+    evicted once the table holds more than `max_entries` rows or
+    `max_bytes` of response text. Hit and miss counters are persisted
+    alongside the responses.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=7 * 24 * 3600, max_entries=5000, max_bytes=256 * 1024**2):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, model TEXT, response TEXT,
+                created REAL, accessed REAL, size INTEGER)""")
+            db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+            db.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0)")
+
+    def _connect(self):
+        return connect(self.path)
+
+    @staticmethod
+    def key(model, prompt, options=None, format=None):
+        parts = [model, normalize_prompt(prompt), options or {}]
+        if format:
+            parts.append(format)
+        payload = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, model, prompt, options=None, format=None):
+        key = self.key(model, prompt, options, format)
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute("SELECT response FROM responses WHERE key = ? AND created > ?",
+                             (key, now - self.ttl)).fetchone()
+            if row is None:
+                db.execute("UPDATE counters SET value = value + 1 WHERE name = 'misses'")
+                return None
+            db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            db.execute("UPDATE counters SET value = value + 1 WHERE name = 'hits'")
+            return row[0]
+
+    def put(self, model, prompt, response, options=None, format=None):
+        now = time.time()
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                       (self.key(model, prompt, options, format), model, response, now, now, len(response.encode())))
+            self._evict(db, now)
+
+    def _evict(self, db, now):
+        db.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,))
+        entries, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if entries <= self.max_entries and size <= self.max_bytes:
+            return
+        # Walk from the least recently used entry until both limits hold again.
+        doomed = []
+        for key, entry_size in db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if entries <= self.max_entries and size <= self.max_bytes:
+                break
+            doomed.append((key,))
+            entries -= 1
+            size -= entry_size
+        db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute("DELETE FROM responses")
+            db.execute("UPDATE counters SET value = 0")
+
+    def stats(self):
+        with self._connect() as db:
+            counters = dict(db.execute("SELECT name, value FROM counters"))
+            entries, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            "hits": counters["hits"],
+            "misses": counters["misses"],
+            "hit_rate": counters["hits"] / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+STOP_WORDS = frozenset("a an and are as be by can do does each for from give has have how i in is it me of on "
+                       "per show the their there to what which with".split())
+
+
+def normalize_question(question):
+    return " ".join(re.findall(r"[a-z0-9]+", question.lower()))
+
+
+def mentioned_columns(question, columns):
+    #Column names appearing in the question; code is only reused when these match exactly.
+    text = f" {normalize_question(question)} "
+    return sorted(str(name) for name in columns if f" {normalize_question(str(name))} " in text)
+
+
+def hashed_embedding(text, dim=EMBEDDING_DIM):
+    """Unit vector of hashed word, word-pair and character-trigram counts.
+
+    A dependency-free stand-in for an embedding model: paraphrases that
+    share most of their words and word stems land close together.
+    """
+    words = [word for word in normalize_question(text).split() if word not in STOP_WORDS]
+    features = words + [" ".join(pair) for pair in zip(words, words[1:])]
+    features += [word[i:i + 3] for word in words for i in range(max(len(word) - 2, 1))]
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+        vector[int.from_bytes(digest[:4], "little") % dim] += 1 if digest[4] & 1 else -1
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class CodeCache:
+    """Generated code of answered questions, looked up by meaning within one schema.
+
+    Questions are embedded with `embed` (named `embedder`, so vectors of
+    different models are never compared) and a lookup returns the code of
+    the most similar earlier question asked about a dataset with the same
+    schema fingerprint, if its cosine similarity reaches `threshold`. Only
+    code that ran without error is stored. Entries expire after `ttl`
+    seconds and the least recently used are evicted past `max_entries`.
+    """
+
+    def __init__(self, embed=hashed_embedding, embedder="hashed", threshold=0.85, path=CACHE_PATH,
+                 ttl=30 * 24 * 3600, max_entries=2000):
+        self.embed = embed
+        self.embedder = embedder
+        self.threshold = threshold
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS code_snippets (
+                schema TEXT, embedder TEXT, question TEXT, columns TEXT, code TEXT, vector BLOB,
+                created REAL, accessed REAL, PRIMARY KEY (schema, embedder, question))""")
+            db.execute("CREATE INDEX IF NOT EXISTS code_snippets_accessed ON code_snippets (accessed)")
+            db.execute("CREATE TABLE IF NOT EXISTS code_counters (name TEXT PRIMARY KEY, value INTEGER)")
+            db.execute("INSERT OR IGNORE INTO code_counters VALUES ('hits', 0), ('misses', 0)")
+
+    def _connect(self):
+        return connect(self.path)
+
+    def _vector(self, question):
+        #Unit length, so a dot product is the cosine similarity whatever the model returns.
+        vector = np.asarray(self.embed(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def schema_key(df):
+        #Column names and dtypes only, so code is shared by every dataset of the same shape.
+        payload = json.dumps([[str(name), str(dtype)] for name, dtype in df.dtypes.items()])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, schema, question, columns=()):
+        """(code, similarity) of the closest earlier question, or None below the threshold.
+
+        Only questions naming the same columns of `columns` are candidates,
+        "histogram of age" must not answer "histogram of income".
+        """
+        vector = self._vector(question)
+        mentioned = json.dumps(mentioned_columns(question, columns))
+        now = time.time()
+        with self._connect() as db:
+            rows = db.execute("SELECT question, code, vector FROM code_snippets "
+                              "WHERE schema = ? AND embedder = ? AND columns = ? AND created > ?",
+                              (schema, self.embedder, mentioned, now - self.ttl)).fetchall()
+            best = None
+            if rows:
+                vectors = np.stack([np.frombuffer(row[2], dtype=np.float32) for row in rows])
+                scores = vectors @ vector
+                index = int(np.argmax(scores))
+                if scores[index] >= self.threshold:
+                    best = rows[index][:2] + (float(scores[index]),)
+            if best is None:
+                db.execute("UPDATE code_counters SET value = value + 1 WHERE name = 'misses'")
+                return None
+            db.execute("UPDATE code_snippets SET accessed = ? WHERE schema = ? AND embedder = ? AND question = ?",
+                       (now, schema, self.embedder, best[0]))
+            db.execute("UPDATE code_counters SET value = value + 1 WHERE name = 'hits'")
+            return best[1], best[2]
+
+    def put(self, schema, question, code, columns=()):
+        vector = self._vector(question)
+        mentioned = json.dumps(mentioned_columns(question, columns))
+        now = time.time()
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO code_snippets VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       (schema, self.embedder, normalize_question(question), mentioned, code, vector.tobytes(),
+                        now, now))
+            db.execute("DELETE FROM code_snippets WHERE created <= ?", (now - self.ttl,))
+            db.execute("""DELETE FROM code_snippets WHERE rowid IN (
+                SELECT rowid FROM code_snippets ORDER BY accessed DESC LIMIT -1 OFFSET ?)""", (self.max_entries,))
+
+    def forget(self, schema, code):
+        #Cached code that failed on a later dataset is dropped rather than served again.
+        with self._connect() as db:
+            db.execute("DELETE FROM code_snippets WHERE schema = ? AND code = ?", (schema, code))
+
+    def stats(self):
+        with self._connect() as db:
+            counters = dict(db.execute("SELECT name, value FROM code_counters"))
+            entries = db.execute("SELECT COUNT(*) FROM code_snippets").fetchone()[0]
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            "hits": counters["hits"],
+            "misses": counters["misses"],
+            "hit_rate": counters["hits"] / lookups if lookups else 0.0,
+            "entries": entries,
+        }
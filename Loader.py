@@ -0,0 +1,322 @@
+import hashlib
+import io
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.feather as feather
+import pyarrow.json as pa_json
+import pyarrow.parquet as pq
+
+from Sketches import DatasetSketch
+
+CACHE_DIR = Path("outputs/cache")
+ARROW_STRINGS = {pa.string(): pd.StringDtype("pyarrow"), pa.large_string(): pd.StringDtype("pyarrow")}
+
+
+def file_fingerprint(uploaded_file):
+    #Content hash of the uploaded bytes, same file -> same key regardless of its name.
+    buffer = uploaded_file.getbuffer()
+    try:
+        return hashlib.blake2b(buffer, digest_size=16).hexdigest()
+    finally:
+        buffer.release()
+
+
+def dataset_key(fingerprint, sheet=None, columns=None, compact=False):
+    #Cache key for one parsed view of an upload (a workbook sheet, a parquet column subset, compacted dtypes).
+    key = fingerprint
+    if sheet is not None:
+        key += "-" + hashlib.blake2b(str(sheet).encode(), digest_size=4).hexdigest()
+    if columns is not None:
+        key += "-" + hashlib.blake2b("\x1f".join(columns).encode(), digest_size=4).hexdigest()
+    if compact:
+        # Versioned, files written by earlier, lossy or overflow-prone compactions must not be served.
+        key += "-compact3"
+    return key
+
+
+def evict_files(paths, max_bytes, keep=None):
+    #Delete the least recently used files (by mtime) until the rest fit in max_bytes, never `keep`.
+    files = [(p, p.stat()) for p in paths]
+    total = sum(stat.st_size for _, stat in files)
+    for path, stat in sorted(files, key=lambda item: item[1].st_mtime):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        path.unlink(missing_ok=True)
+        total -= stat.st_size
+
+
+class DatasetCache:
+    """On-disk store of parsed datasets keyed by content hash.
+
+    Every dataset is written once as an uncompressed Arrow IPC (Feather v2)
+    file so later loads can memory-map it instead of parsing the source again.
+    The directory is kept under `max_bytes` by evicting the least recently
+    used files; a hit refreshes the file's mtime, which is the LRU clock.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if max_bytes is None:
+            from Functions import setting
+            max_bytes = int(setting("cache", "max_gb", 5) * 1024**3)
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return self.directory / f"{key}.arrow"
+
+    def __contains__(self, key):
+        return self.path(key).exists()
+
+    def load(self, key, arrow_strings=False):
+        #Memory-mapped read, the table's buffers point straight into the page cache.
+        path = self.path(key)
+        if not path.exists():
+            return None
+        try:
+            table = feather.read_table(path, memory_map=True)
+        except (OSError, pa.ArrowInvalid):
+            path.unlink(missing_ok=True)
+            return None
+        os.utime(path)
+        # split_blocks keeps numeric columns without nulls as views of the mapped buffers.
+        types_mapper = ARROW_STRINGS.get if arrow_strings else None
+        return table.to_pandas(split_blocks=True, types_mapper=types_mapper)
+
+    def save(self, key, df):
+        path = self.path(key)
+        tmp = path.with_suffix(".tmp")
+        try:
+            feather.write_feather(df, tmp, compression="uncompressed")
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, ValueError):
+            # Mixed-type object columns cannot be expressed in Arrow, leave those uncached.
+            tmp.unlink(missing_ok=True)
+            return False
+        os.replace(tmp, path)
+        self.evict()
+        return True
+
+    def evict(self):
+        evict_files(self.directory.glob("*.arrow"), self.max_bytes)
+
+    def size(self):
+        return sum(p.stat().st_size for p in self.directory.glob("*.arrow"))
+
+
+DELIMITERS = {".csv": ",", ".tsv": "\t", ".txt": "\t"}
+
+
+def _arrow_source(source):
+    # Zero-copy view over an in-memory upload; paths and other file objects are passed through.
+    if hasattr(source, "getbuffer"):
+        return pa.BufferReader(pa.py_buffer(source.getbuffer()))
+    return source
+
+
+def _is_json_lines(source):
+    source.seek(0)
+    head = source.read(4096).lstrip()
+    source.seek(0)
+    return head[:1] == b"{" and b"\n{" in head.replace(b"\r\n", b"\n")
+
+
+def excel_sheets(source):
+    return pd.ExcelFile(source).sheet_names
+
+
+def parquet_columns(source):
+    #Only the footer is read, so this is cheap even for very large files.
+    return pq.read_schema(_arrow_source(source)).names
+
+
+def _read_sheet(data, sheet):
+    return pd.read_excel(io.BytesIO(data), sheet_name=sheet)
+
+
+def read_excel_sheets(source, sheets):
+    #Parse several worksheets of one workbook in parallel worker processes.
+    workers = min(len(sheets), os.cpu_count() or 1)
+    if workers <= 1:
+        source.seek(0)
+        return pd.read_excel(source, sheet_name=list(sheets))
+    from Functions import SpawnPool
+    data = source.getvalue()
+    with SpawnPool(workers) as pool:
+        frames = pool.map(_read_sheet, [data] * len(sheets), sheets)
+        return dict(zip(sheets, frames))
+
+
+def read_dataset(source, suffix, sheet=None, columns=None):
+    """Parse an upload with the fastest reader available for its format.
+
+    Delimited text goes through the multithreaded pyarrow CSV engine and
+    newline-delimited JSON through pyarrow's block-parallel JSON reader,
+    both falling back to pandas for input pyarrow rejects. Parquet reads are
+    projected to `columns`, Excel reads a single `sheet`.
+    """
+    source.seek(0)
+    if suffix in DELIMITERS:
+        try:
+            table = pa_csv.read_csv(
+                _arrow_source(source),
+                read_options=pa_csv.ReadOptions(use_threads=True, block_size=1 << 24),
+                parse_options=pa_csv.ParseOptions(delimiter=DELIMITERS[suffix]),
+                # "" and "NA" in text columns are missing values, as for pandas and the streamed reader.
+                convert_options=pa_csv.ConvertOptions(strings_can_be_null=True),
+            )
+            return table.to_pandas(split_blocks=True, self_destruct=True)
+        except pa.ArrowInvalid:
+            source.seek(0)
+            return pd.read_csv(source, sep=DELIMITERS[suffix])
+    if suffix in [".jsonl", ".ndjson"] or (suffix == ".json" and _is_json_lines(source)):
+        try:
+            table = pa_json.read_json(_arrow_source(source), read_options=pa_json.ReadOptions(use_threads=True))
+            return table.to_pandas(split_blocks=True, self_destruct=True)
+        except pa.ArrowInvalid:
+            source.seek(0)
+            return pd.read_json(source, lines=True)
+    if suffix == ".json":
+        return pd.read_json(source)
+    if suffix in [".xlsx", ".xls"]:
+        return pd.read_excel(source, sheet_name=sheet if sheet is not None else 0)
+    if suffix == ".parquet":
+        table = pq.read_table(_arrow_source(source), columns=columns, use_threads=True)
+        return table.to_pandas(split_blocks=True, self_destruct=True)
+    raise ValueError(f"Unsupported file format: {suffix}")
+
+
+STREAMABLE = {".csv": ",", ".tsv": "\t", ".txt": "\t", ".jsonl": None, ".ndjson": None}
+
+
+class ChunkedLoader:
+    """Background, chunk-by-chunk reader for delimited and JSON-lines uploads.
+
+    The first chunk is available almost immediately as `sample`; while the
+    rest of the file streams in the sample is kept as a uniform random subset
+    of every row read so far (bottom-k on random keys, in file order). When
+    `done` is set, `df` holds the full frame or `error` the failure. A
+    DatasetSketch of every chunk is kept in `sketch` for approximate stats.
+    """
+
+    def __init__(self, uploaded_file, suffix, fingerprint, cache=None, compact=False,
+                 chunksize=200_000, sample_size=50_000):
+        self.file = uploaded_file
+        self.compact = compact
+        self.memory = None
+        self.sketch = DatasetSketch()
+        self.suffix = suffix
+        self.fingerprint = fingerprint
+        self.cache = cache
+        self.chunksize = chunksize
+        self.sample_size = sample_size
+        self.total = max(uploaded_file.size, 1)
+        self.rows = 0
+        self.position = 0
+        self.sample = None
+        self.df = None
+        self.error = None
+        self.done = False
+        self.first_chunk = threading.Event()
+        self._keys = None
+        self._rng = np.random.default_rng()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def progress(self):
+        return 1.0 if self.done else min(self.position / self.total, 0.99)
+
+    def _chunks(self):
+        self.file.seek(0)
+        sep = STREAMABLE[self.suffix]
+        if sep is None:
+            return pd.read_json(self.file, lines=True, chunksize=self.chunksize)
+        return pd.read_csv(self.file, sep=sep, chunksize=self.chunksize)
+
+    def _update_sample(self, chunk):
+        keys = self._rng.random(len(chunk))
+        if self.sample is not None:
+            chunk = pd.concat([self.sample, chunk])
+            keys = np.concatenate([self._keys, keys])
+        if len(chunk) > self.sample_size:
+            keep = np.sort(np.argpartition(keys, self.sample_size)[:self.sample_size])
+            chunk, keys = chunk.iloc[keep], keys[keep]
+        self._keys = keys
+        self.sample = chunk
+
+    def _run(self):
+        chunks = []
+        try:
+            with self._chunks() as reader:
+                for chunk in reader:
+                    chunk.index = pd.RangeIndex(self.rows, self.rows + len(chunk))
+                    chunks.append(chunk)
+                    self.rows += len(chunk)
+                    self.position = self.file.tell()
+                    self._update_sample(chunk)
+                    self.sketch.update(chunk)
+                    self.first_chunk.set()
+            self.df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+            chunks.clear()
+            if self.compact:
+                self.df, before, after = compact_dtypes(self.df)
+                self.memory = (before, after)
+            if self.cache is not None:
+                self.cache.save(self.fingerprint, self.df)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self.first_chunk.set()
+
+
+def compact_dtypes(df, category_ratio=0.5, category_max=1000):
+    """Shrink a freshly loaded frame to the smallest lossless dtypes.
+
+    64-bit integers become int32 when their values fit, floats float32 only
+    when every value survives the round trip exactly, object columns with
+    few distinct values become `category` and the remaining text columns
+    Arrow-backed `string[pyarrow]`.
+    Returns the new frame with its deep memory use before and after.
+    """
+    before = int(df.memory_usage(deep=True).sum())
+    columns = {}
+    for name, col in df.items():
+        if pd.api.types.is_bool_dtype(col) or isinstance(col.dtype, pd.CategoricalDtype):
+            continue
+        if pd.api.types.is_integer_dtype(col) and col.dtype.itemsize > 4:
+            # Signed and no narrower than int32, so arithmetic in pages and generated code does not wrap.
+            info = np.iinfo(np.int32)
+            if not len(col) or (col.min() >= info.min and col.max() <= info.max):
+                nullable = isinstance(col.dtype, pd.api.extensions.ExtensionDtype)
+                columns[name] = col.astype(pd.Int32Dtype() if nullable else np.int32)
+        elif pd.api.types.is_float_dtype(col) and col.dtype.itemsize > 4:
+            values = col.to_numpy(dtype=np.float64, na_value=np.nan)
+            if np.array_equal(values, values.astype(np.float32).astype(np.float64), equal_nan=True):
+                columns[name] = pd.to_numeric(col, downcast="float")
+        elif pd.api.types.is_object_dtype(col) or pd.api.types.is_string_dtype(col):
+            if pd.api.types.infer_dtype(col, skipna=True) not in ["string", "empty"]:
+                continue
+            unique = col.nunique(dropna=True)
+            if unique <= category_max and unique <= category_ratio * len(col):
+                columns[name] = col.astype("category")
+            else:
+                columns[name] = col.astype("string[pyarrow]")
+    if columns:
+        df = df.copy(deep=False)
+        for name, col in columns.items():
+            df[name] = col
+    after = int(df.memory_usage(deep=True).sum())
+    return df, before, after
+
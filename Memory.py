@@ -0,0 +1,162 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from Shared import shared_store, sizeof
+
+
+def resident_bytes(df):
+    """Memory a memory-mapped frame holds outside its mapping, estimated from its column types.
+
+    Arrow hands numeric and datetime columns and Arrow-backed strings over
+    without copying; booleans, categoricals and nullable or object columns
+    are copied into memory.
+    """
+    total = int(df.index.memory_usage())
+    for _, col in df.items():
+        dtype = col.dtype
+        mapped = (isinstance(dtype, np.dtype) and dtype.kind in "iufmM") or (
+            isinstance(dtype, pd.StringDtype) and dtype.storage == "pyarrow")
+        if not mapped:
+            total += int(col.memory_usage(deep=True, index=False))
+    return total
+
+
+def _measure(key, value):
+    """(bytes, note, reusable) of one session state item; `reusable` sizes may be remembered per object."""
+    from History import ChatHistory
+    from Loader import ChunkedLoader
+    if isinstance(value, ChatHistory):
+        return value.memory_bytes, f"{len(value):,} messages, {value.disk_bytes / 1024**2:,.1f} MB on disk", False
+    if isinstance(value, ChunkedLoader):
+        return sizeof(value.sample), "loading in the background", True
+    if hasattr(value, "file_id") and hasattr(value, "size"):
+        return value.size, "held by the file uploader", True
+    if isinstance(value, pd.DataFrame):
+        mapped = st.session_state.get("spilled_df") == st.session_state.get("fingerprint")
+        usage = shared_store().usage(st.session_state.get("shared_dataset"))
+        if usage is not None and usage[0] is value:
+            # A dataset shared by several sessions is split between them; the split changes as sessions come and go.
+            sessions = max(usage[2], 1)
+            notes = ["memory-mapped from disk"] if mapped else []
+            notes += [f"shared with {sessions - 1:,} other sessions"] if sessions > 1 else []
+            return usage[1] // sessions, ", ".join(notes), False
+        if mapped:
+            return resident_bytes(value), "memory-mapped from disk", True
+    return sizeof(value), "", True
+
+
+def session_footprint():
+    """Per-item memory of the current session, largest first.
+
+    Sizes are remembered per object, so an unchanged dataset is measured
+    once rather than on every rerun; the chat history and shared datasets
+    are always re-read.
+    """
+    sizes = st.session_state.setdefault("memory_sizes", {})
+    rows = []
+    for key in list(st.session_state.keys()):
+        if key == "memory_sizes" or key.startswith("FormSubmitter") or key.startswith("$$"):
+            continue
+        value = st.session_state[key]
+        cached = sizes.get(key)
+        if cached is not None and cached[0] == id(value):
+            size, note = cached[1:]
+        else:
+            size, note, reusable = _measure(key, value)
+            if reusable:
+                sizes[key] = (id(value), size, note)
+            else:
+                sizes.pop(key, None)
+        rows.append({"item": key, "bytes": size, "note": note})
+    frame = pd.DataFrame(rows, columns=["item", "bytes", "note"])
+    return frame.sort_values("bytes", ascending=False, ignore_index=True)
+
+
+def follow_spilled_dataset():
+    #Point this session at the memory-mapped copy when another session spilled the dataset they share.
+    key = st.session_state.get("shared_dataset")
+    if key is None or key != st.session_state.get("fingerprint"):
+        return
+    usage = shared_store().usage(key)
+    if usage is not None and usage[0] is not st.session_state.df:
+        st.session_state.df = usage[0]
+        st.session_state.spilled_df = key
+
+
+def _spill_df():
+    #Writes the session's frame to the Arrow cache and swaps it for a memory-mapped copy, whose pages the OS can drop.
+    from Loader import DatasetCache
+    fingerprint = st.session_state.fingerprint
+    if fingerprint is None or "-sample" in fingerprint or st.session_state.get("spilled_df") == fingerprint:
+        # Already mapped, or a preview of a file still streaming in that the full frame replaces soon anyway.
+        return False
+    df = st.session_state.df
+    cache = DatasetCache()
+    if fingerprint not in cache and not cache.save(fingerprint, df):
+        return False
+    # Arrow-backed strings stay in the mapped buffers, object strings would be copied back into memory.
+    mapped = cache.load(fingerprint, arrow_strings=True)
+    if mapped is None:
+        return False
+    if st.session_state.get("shared_dataset") == fingerprint:
+        # Other sessions holding this dataset move to the mapped copy on their next rerun.
+        shared_store().replace(fingerprint, mapped, resident_bytes(mapped))
+    st.session_state.df = mapped
+    st.session_state.spilled_df = fingerprint
+    return True
+
+
+def _spill_history():
+    st.session_state.history.spill_all()
+    return True
+
+
+def _drop_sketch():
+    # Only a shortcut for approximate statistics, they can be recomputed from the frame.
+    del st.session_state["sketch"]
+    return True
+
+
+SPILLERS = {"df": _spill_df, "history": _spill_history, "sketch": _drop_sketch}
+
+
+def govern_session(limit_bytes):
+    """Measure the session and spill its largest spillable items until it fits in `limit_bytes`.
+
+    Returns the footprint table after spilling and the items spilled.
+    """
+    footprint = session_footprint()
+    spilled = []
+    total = int(footprint["bytes"].sum())
+    for row in footprint.itertuples():
+        if total <= limit_bytes:
+            break
+        spill = SPILLERS.get(row.item)
+        if spill is None or row.bytes == 0:
+            continue
+        try:
+            if spill():
+                spilled.append(row.item)
+                total -= row.bytes
+        except Exception:
+            # Spilling is best effort; the item simply stays in memory.
+            continue
+    if spilled:
+        footprint = session_footprint()
+    return footprint, spilled
+
+
+def memory_panel():
+    #Sidebar summary of this session's memory, spilling first when it is over the configured limit.
+    from Functions import setting
+    limit = int(setting("memory", "session_mb", 1024) * 1024**2)
+    follow_spilled_dataset()
+    footprint, spilled = govern_session(limit)
+    total = int(footprint["bytes"].sum())
+    st.caption(f"Session memory: {total / 1024**2:,.1f} MB of {limit / 1024**2:,.0f} MB")
+    if spilled:
+        st.caption("Spilled to disk: " + ", ".join(spilled))
+    with st.expander("Session memory"):
+        shown = footprint[footprint["bytes"] > 0].assign(MB=lambda frame: frame["bytes"] / 1024**2)
+        st.dataframe(shown[["item", "MB", "note"]], hide_index=True)
@@ -0,0 +1,257 @@
+import math
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from Shared import shared_cache
+from Sketches import KLLSketch
+from Stats import block_columns
+
+CHUNK_ROWS = 500_000
+TREES = 32
+TREE_SAMPLE = 256
+GRID_CELLS = 1 << 14
+
+
+def _path_length(n):
+    #Average depth of an unsuccessful binary search tree lookup, c(n) in the isolation forest paper.
+    if n <= 1:
+        return 0.0
+    return 2 * (math.log(n - 1) + 0.5772156649) - 2 * (n - 1) / n
+
+
+def _isolation_tree(sample, rng, limit):
+    """Split values and leaf depths of one random 1-D isolation tree over a sorted sample.
+
+    A tree cuts the line into intervals; walking it in order yields the
+    split values ascending, and the leaf between two consecutive splits
+    has depth (splits on the way) + c(points left in the leaf).
+    """
+    splits, depths = [], []
+
+    def grow(lo, hi, depth):
+        if hi - lo <= 1 or depth >= limit or sample[lo] == sample[hi - 1]:
+            depths.append(depth + _path_length(hi - lo))
+            return
+        value = rng.uniform(sample[lo], sample[hi - 1])
+        middle = lo + int(np.searchsorted(sample[lo:hi], value, side="left"))
+        grow(lo, middle, depth + 1)
+        splits.append(value)
+        grow(middle, hi, depth + 1)
+
+    grow(0, len(sample), 0)
+    return np.asarray(splits), np.asarray(depths)
+
+
+def isolation_table(values, trees=TREES, sample_size=TREE_SAMPLE, grid=GRID_CELLS, seed=0):
+    """Isolation score of one column as a lookup table over a uniform grid.
+
+    In one dimension the path of a value through a tree only depends on
+    which interval between split values it falls in, so the forest's mean
+    depth is a step function of the value. It is tabulated on `grid` cells
+    spanning the sample, which makes scoring a column one multiply and one
+    take. Values beyond the grid share the outermost cells' scores, as
+    they share those leaves in every tree. The score is
+    2 ** (-mean depth / c(sample_size)) as in an isolation forest.
+    Returns (low, step, scores).
+    """
+    rng = np.random.default_rng(seed)
+    values = values[np.isfinite(values)]
+    if len(values) < 2 or values.min() == values.max():
+        return 0.0, 1.0, np.zeros(1)
+    size = min(sample_size, len(values))
+    limit = math.ceil(math.log2(size))
+    forest = [_isolation_tree(np.sort(rng.choice(values, size, replace=False)), rng, limit) for _ in range(trees)]
+    low, high = values.min(), values.max()
+    step = (high - low) / grid
+    probes = low + (np.arange(grid) + 0.5) * step
+    depth = sum(depths[np.searchsorted(splits, probes, side="right")] for splits, depths in forest) / trees
+    return low, step, np.exp2(-depth / _path_length(size))
+
+
+def isolation_scores(table, values):
+    low, step, scores = table
+    cells = np.clip((values - low) / step, 0, len(scores) - 1)
+    return np.where(np.isnan(values), 0, scores[np.nan_to_num(cells).astype(np.intp)])
+
+
+@dataclass
+class OutlierModel:
+    """Per-column thresholds fitted once and applied to any chunk of the same data.
+
+    For every numeric column: the Tukey fences (q1 - k IQR, q3 + k IQR),
+    the median and MAD for robust z-scores, and an isolation score table.
+    """
+    fences: pd.DataFrame
+    isolation: dict
+    mad_threshold: float = 3.5
+    isolation_threshold: float = 0.75
+
+    @classmethod
+    def fit(cls, source, quartiles=None, iqr_k=1.5, mad_threshold=3.5, isolation_threshold=0.75,
+            sample_size=TREES * TREE_SAMPLE):
+        """Fit from a DataFrame (exact quantiles) or an iterable of chunks (KLL sketches).
+
+        Chunks only need to be read once: quantiles come from mergeable
+        sketches and the MAD and isolation trees from a uniform sample.
+        `quartiles` (DatasetStats.numeric) saves recomputing the 25%, 50%
+        and 75% quantiles of an in-memory frame.
+        """
+        if isinstance(source, pd.DataFrame):
+            numeric = source.select_dtypes(include=['number'])
+            rows, width = [], block_columns(len(numeric))
+            for start in range(0, numeric.shape[1], width):
+                names = numeric.columns[start:start + width]
+                block = numeric[names].to_numpy(dtype=np.float64, na_value=np.nan)
+                with np.errstate(all="ignore"):
+                    if quartiles is not None and names.isin(quartiles.index).all():
+                        q1, median, q3 = quartiles.loc[names, ["25%", "50%", "75%"]].to_numpy(dtype=np.float64).T
+                    else:
+                        q1, median, q3 = np.nanquantile(block, [0.25, 0.5, 0.75], axis=0)
+                    mad = np.nanmedian(np.abs(block - median), axis=0)
+                    mean_ad = np.nanmean(np.abs(block - median), axis=0)
+                rows.append(pd.DataFrame({"q1": q1, "median": median, "q3": q3, "mad": mad, "mean_ad": mean_ad},
+                                         index=names))
+            fences = pd.concat(rows) if rows else pd.DataFrame(columns=["q1", "median", "q3", "mad", "mean_ad"])
+            # The isolation trees only draw `sample_size` values, so only a uniform row sample is copied out.
+            rng = np.random.default_rng(0)
+            positions = np.sort(rng.choice(len(numeric), min(sample_size, len(numeric)), replace=False))
+            sampled = numeric.iloc[positions]
+            samples = {name: sampled[name].to_numpy(dtype=np.float64, na_value=np.nan) for name in numeric.columns}
+        else:
+            fences, samples = cls._sketch_chunks(source, sample_size)
+        iqr = fences["q3"] - fences["q1"]
+        fences["low"] = fences["q1"] - iqr_k * iqr
+        fences["high"] = fences["q3"] + iqr_k * iqr
+        # A MAD of zero (more than half the values identical) falls back to the scaled mean absolute deviation.
+        fences["scale"] = np.where(fences["mad"] > 0, fences["mad"] / 0.6745, fences["mean_ad"] * 1.2533)
+        isolation = {name: isolation_table(values) for name, values in samples.items()}
+        return cls(fences, isolation, mad_threshold, isolation_threshold)
+
+    @staticmethod
+    def _sketch_chunks(chunks, sample_size):
+        sketches, samples, keys, rng = {}, {}, {}, np.random.default_rng(0)
+        for chunk in chunks:
+            for name, column in chunk.select_dtypes(include=['number']).items():
+                values = column.to_numpy(dtype=np.float64, na_value=np.nan)
+                sketches.setdefault(name, KLLSketch(seed=0)).update(values)
+                # Bottom-k on random keys keeps a uniform sample of everything seen so far.
+                merged = np.concatenate([samples.get(name, np.empty(0)), values])
+                merged_keys = np.concatenate([keys.get(name, np.empty(0)), rng.random(len(values))])
+                if len(merged) > sample_size:
+                    keep = np.argpartition(merged_keys, sample_size)[:sample_size]
+                    merged, merged_keys = merged[keep], merged_keys[keep]
+                samples[name], keys[name] = merged, merged_keys
+        rows = {}
+        for name, sketch in sketches.items():
+            q1, median, q3 = sketch.quantiles([0.25, 0.5, 0.75])
+            deviation = np.abs(samples[name] - median)
+            with np.errstate(all="ignore"):
+                rows[name] = {"q1": q1, "median": median, "q3": q3,
+                              "mad": np.nanmedian(deviation), "mean_ad": np.nanmean(deviation)}
+        return pd.DataFrame.from_dict(rows, orient="index", columns=["q1", "median", "q3", "mad", "mean_ad"]), samples
+
+    def score(self, chunk):
+        """Flags and scores of one chunk, as arrays shaped (rows, numeric columns)."""
+        names = self.fences.index
+        values = chunk[names].to_numpy(dtype=np.float64, na_value=np.nan)
+        fences = self.fences
+        iqr = (values < fences["low"].to_numpy()) | (values > fences["high"].to_numpy())
+        with np.errstate(all="ignore"):
+            robust_z = np.abs(values - fences["median"].to_numpy()) / fences["scale"].to_numpy()
+        robust_z = np.where(np.isfinite(robust_z), robust_z, 0)
+        isolation = np.zeros_like(values)
+        for i, name in enumerate(names):
+            isolation[:, i] = isolation_scores(self.isolation[name], values[:, i])
+        return {
+            "iqr": iqr,
+            "mad": robust_z > self.mad_threshold,
+            "isolation": isolation > self.isolation_threshold,
+            "robust_z": robust_z,
+            "isolation_score": isolation,
+        }
+
+
+@dataclass
+class OutlierReport:
+    """Per-column outlier counts and the most extreme flagged rows.
+
+    `columns` has one row per numeric column with its fences, how many
+    values each method flagged and how many were `flagged`, i.e. by at
+    least two of the three methods; `rows` holds up to `max_rows` rows with
+    a flagged value, ordered by their largest robust z-score.
+    """
+    columns: pd.DataFrame
+    rows: pd.DataFrame
+    flagged_rows: int
+    total_rows: int
+
+    def to_context(self, limit=10):
+        #Compact facts for the LLM, only columns that actually have outliers.
+        flagged = self.columns[self.columns["flagged"] > 0].sort_values("flagged", ascending=False)
+        if flagged.empty:
+            return "No outliers found by IQR, robust z-score or isolation score."
+        lines = [f"{self.flagged_rows:,} of {self.total_rows:,} rows have a value flagged by at least two methods."]
+        for name, row in flagged.head(limit).iterrows():
+            lines.append(f"- {name}: {int(row['flagged']):,} flagged; {int(row['iqr']):,} outside IQR fences "
+                         f"[{row['low']:.4g}, {row['high']:.4g}], {int(row['mad']):,} with robust |z| > "
+                         f"{row['mad_threshold']:g}, {int(row['isolation']):,} isolated")
+        if len(flagged) > limit:
+            lines.append(f"- {len(flagged) - limit} more columns with outliers")
+        return "\n".join(lines)
+
+
+def detect_outliers(model, chunks, max_rows=500):
+    """Apply a fitted model chunk by chunk and collect an OutlierReport.
+
+    A value is flagged when at least two of IQR fences, robust z-score and
+    isolation score agree. Only counts and the current `max_rows` strongest
+    rows are kept between chunks, so memory does not grow with the data.
+    """
+    names = model.fences.index
+    counts = {method: np.zeros(len(names), dtype=np.int64) for method in ["iqr", "mad", "isolation", "flagged"]}
+    best, flagged_rows, total_rows = [], 0, 0
+    for chunk in chunks:
+        scores = model.score(chunk)
+        flags = (scores["iqr"].astype(np.int8) + scores["mad"] + scores["isolation"]) >= 2
+        for method in ["iqr", "mad", "isolation"]:
+            counts[method] += scores[method].sum(axis=0)
+        counts["flagged"] += flags.sum(axis=0)
+        total_rows += len(chunk)
+        rows = np.flatnonzero(flags.any(axis=1))
+        flagged_rows += len(rows)
+        if len(rows) == 0:
+            continue
+        strength = np.where(flags[rows], scores["robust_z"][rows], 0).max(axis=1)
+        top = rows[np.argsort(strength, kind="stable")[::-1][:max_rows]]
+        table = chunk.iloc[top].copy()
+        table.insert(0, "outlier columns", [", ".join(map(str, names[row])) for row in flags[top]])
+        table.insert(1, "robust z", np.where(flags[top], scores["robust_z"][top], 0).max(axis=1))
+        table.insert(2, "isolation score", np.where(flags[top], scores["isolation_score"][top], 0).max(axis=1))
+        best.append(table)
+        best = [pd.concat(best).sort_values("robust z", ascending=False, kind="stable").head(max_rows)]
+
+    columns = model.fences[["low", "high", "median", "scale"]].assign(
+        mad_threshold=model.mad_threshold, **{method: count for method, count in counts.items()})
+    rows = best[0] if best else pd.DataFrame()
+    return OutlierReport(columns, rows, flagged_rows, total_rows)
+
+
+def frame_chunks(df, rows=CHUNK_ROWS):
+    for start in range(0, len(df), rows):
+        yield df.iloc[start:start + rows]
+
+
+@shared_cache("outliers", show_spinner="Detecting outliers...")
+def outlier_report(fingerprint, _df, _stats=None, approximate=False, mad_threshold=3.5, isolation_threshold=0.75):
+    """Memoized per dataset fingerprint, the frame itself is never hashed.
+
+    `_stats` lends its quartiles; `approximate` fits from sketches chunk by
+    chunk, as for data that does not fit in memory, instead of exact
+    quantiles and MADs over whole columns.
+    """
+    source = frame_chunks(_df) if approximate else _df
+    quartiles = _stats.numeric if _stats is not None and not approximate else None
+    model = OutlierModel.fit(source, quartiles, mad_threshold=mad_threshold, isolation_threshold=isolation_threshold)
+    return detect_outliers(model, frame_chunks(_df))
@@ -0,0 +1,463 @@
+import io
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import streamlit as st
+
+from Shared import shared_cache
+
+DENSITY_BINS = (400, 300)
+MAX_GROUPS = 10
+
+
+def stratified_sample(df, size, by=None, seed=0):
+    """About `size` rows of `df`, sampled without replacement and kept in row order.
+
+    With `by`, every group gets a share proportional to its size, but never
+    fewer than min(group size, size // (10 * groups)) rows, so rare colour
+    groups stay visible. A fixed seed keeps reruns identical.
+    """
+    if len(df) <= size:
+        return df
+    rng = np.random.default_rng(seed)
+    if by is None:
+        return df.iloc[np.sort(rng.choice(len(df), size, replace=False))]
+    codes, _ = pd.factorize(df[by], use_na_sentinel=False)
+    counts = np.bincount(codes)
+    floor = np.minimum(counts, max(size // (10 * len(counts)), 1))
+    quota = np.maximum(np.round(counts * size / len(df)).astype(np.int64), floor)
+    # Random order inside each group, then the first quota[group] rows of every group are kept.
+    order = np.lexsort((rng.random(len(codes)), codes))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rank = np.arange(len(codes)) - starts[codes[order]]
+    return df.iloc[np.sort(order[rank < quota[codes[order]]])]
+
+
+def _density_axis(values):
+    if pd.api.types.is_datetime64_any_dtype(values):
+        # Nanoseconds since the epoch, NaT becomes NaN like any other missing value.
+        return values.dt.tz_localize(None).astype("int64").where(values.notna()).to_numpy(dtype=np.float64)
+    return values.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _top_groups(column):
+    #The MAX_GROUPS - 1 most frequent groups keep their own colour, the rest are drawn as "Other".
+    labels = column.astype(str).where(column.notna(), "NaN")
+    top = labels.value_counts().index[:MAX_GROUPS - 1]
+    return labels.where(labels.isin(top), "Other")
+
+
+def density_figure(df, x, y, color=None, bins=DENSITY_BINS):
+    """Server-side 2D binning of a scatter plot, returns the figure and the number of cells sent.
+
+    Without `color` the counts are drawn as a log-scaled heatmap. With
+    `color` every cell takes the colour of its most frequent group and its
+    opacity grows with the total count, like a categorical datashader image.
+    A datetime `x` is binned on its timestamps and only supported without `color`.
+    """
+    xs, ys = _density_axis(df[x]), _density_axis(df[y])
+    finite = np.isfinite(xs) & np.isfinite(ys)
+    xs, ys = xs[finite], ys[finite]
+    x_edges = np.histogram_bin_edges(xs, bins=bins[0])
+    y_edges = np.histogram_bin_edges(ys, bins=bins[1])
+    fig = go.Figure()
+    if color is None:
+        counts, _, _ = np.histogram2d(xs, ys, bins=[x_edges, y_edges])
+        z = np.where(counts > 0, np.log10(np.maximum(counts, 1)), np.nan).T
+        x_centers = (x_edges[:-1] + x_edges[1:]) / 2
+        if pd.api.types.is_datetime64_any_dtype(df[x]):
+            x_centers = pd.to_datetime(x_centers.astype("int64"))
+        fig.add_trace(go.Heatmap(
+            x=x_centers, y=(y_edges[:-1] + y_edges[1:]) / 2, z=z,
+            customdata=counts.T, colorscale="Viridis", colorbar={"title": "log10(count)"},
+            hovertemplate=f"{x}: %{{x}}<br>{y}: %{{y}}<br>count: %{{customdata:,}}<extra></extra>",
+        ))
+        return fig, int((counts > 0).sum())
+
+    groups = _top_groups(df[color])[finite]
+    names = groups.value_counts().index.tolist()
+    codes = pd.Categorical(groups, categories=names).codes
+    counts = np.stack([np.histogram2d(xs[codes == i], ys[codes == i], bins=[x_edges, y_edges])[0]
+                       for i in range(len(names))])
+    total = counts.sum(axis=0)
+    palette = np.array([px.colors.hex_to_rgb(c) for c in px.colors.qualitative.Plotly], dtype=np.uint8)
+    rgba = np.zeros(total.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = palette[counts.argmax(axis=0) % len(palette)]
+    alpha = np.log1p(total) / np.log1p(max(total.max(), 1))
+    rgba[..., 3] = np.where(total > 0, 60 + 195 * alpha, 0).astype(np.uint8)
+    # go.Image rows run along y, so the (x, y) histogram is transposed.
+    fig.add_trace(go.Image(
+        z=rgba.transpose(1, 0, 2), colormodel="rgba", x0=(x_edges[0] + x_edges[1]) / 2, dx=x_edges[1] - x_edges[0],
+        y0=(y_edges[0] + y_edges[1]) / 2, dy=y_edges[1] - y_edges[0], hoverinfo="skip",
+    ))
+    for i, name in enumerate(names):
+        fig.add_trace(go.Scatter(x=[None], y=[None], mode="markers", name=name,
+                                 marker={"color": px.colors.qualitative.Plotly[i % len(palette)]}))
+    fig.update_yaxes(autorange=True)
+    fig.update_layout(legend_title_text=color)
+    return fig, int((total > 0).sum())
+
+
+@st.cache_data(max_entries=32, show_spinner="Reducing points...")
+def large_scatter(fingerprint, _df, x, y, color=None, mode="WebGL sample", max_points=200_000):
+    """Scatter plot for frames too large to send point by point.
+
+    "Density" bins numeric axes on the server, anything else draws a
+    stratified sample of `max_points` rows with WebGL. Returns the figure,
+    how many marks it carries and what they are ("points" or "density cells").
+    Memoized per dataset fingerprint, the frame itself is never hashed.
+    """
+    title = f"{y} vs {x}" + (f" colored by {color}" if color else "")
+    numeric_x = pd.api.types.is_numeric_dtype(_df[x]) and not pd.api.types.is_bool_dtype(_df[x])
+    datetime_x = pd.api.types.is_datetime64_any_dtype(_df[x]) and color is None
+    if mode == "Density" and (numeric_x or datetime_x):
+        fig, sent = density_figure(_df, x, y, color)
+        fig.update_layout(title=title, xaxis_title=x, yaxis_title=y)
+        return fig, sent, "density cells"
+    sample = stratified_sample(_df[[c for c in dict.fromkeys([x, y, color]) if c]], max_points, by=color)
+    fig = px.scatter(sample, x=x, y=y, color=color, title=title, render_mode="webgl")
+    return fig, len(sample), "points"
+
+
+def _wall_time(value):
+    #Timestamp as int64 nanoseconds of its local wall time, how _line_axis stores timezone-aware columns.
+    value = pd.Timestamp(value)
+    return (value.tz_localize(None) if value.tz is not None else value).value
+
+
+def _line_axis(values):
+    #Sortable numeric view of an x column: datetimes as int64 nanoseconds, anything else by row position.
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.tz_localize(None).to_numpy(dtype="datetime64[ns]").view("int64"), "datetime"
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        return values.to_numpy(dtype=np.float64, na_value=np.nan), "numeric"
+    return np.arange(len(values), dtype=np.int64), "position"
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets: positions of `threshold` points that keep the shape of (x, y).
+
+    `y` must not contain NaN.
+    """
+    if threshold >= len(x) or threshold < 3:
+        return np.arange(len(x))
+    x = x.astype(np.float64)
+    edges = np.linspace(1, len(x) - 1, threshold - 1).astype(np.int64)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, len(x) - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], max(edges[i + 1], edges[i] + 1)
+        end = max(edges[i + 2], stop + 1) if i + 2 < len(edges) else len(x)
+        avg_x, avg_y = x[stop:end].mean(), y[stop:end].mean()
+        # The point forming the largest triangle with the previous pick and the next bucket's average wins.
+        area = np.abs((x[previous] - avg_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (avg_y - y[previous]))
+        previous = start + int(area.argmax())
+        keep[i + 1] = previous
+    return keep
+
+
+class LinePyramid:
+    """Multi-resolution min/max index of one (x, y) series, built once per dataset.
+
+    Points are sorted by x; level k stores, for every bucket of 2**(k+1)
+    consecutive points, the positions of its minimum and maximum y. A query
+    for an x range picks the coarsest level that still returns about
+    `points` values, so the cost depends on the screen width and not on
+    the number of rows.
+    """
+
+    def __init__(self, x, y, kind="numeric"):
+        valid = ~np.isnan(x) if kind == "numeric" else x != np.iinfo(np.int64).min
+        x, y = x[valid], y[valid]
+        order = np.argsort(x, kind="stable")
+        self.kind = kind
+        self.x = x[order]
+        self.y = y[order]
+        self.rows = np.flatnonzero(valid)[order]
+        self.levels = []
+        index = np.int32 if len(self.x) < 2**31 else np.int64
+        low = high = np.arange(len(self.x), dtype=index)
+        y = self.y
+        while len(low) > 1:
+            if len(low) % 2:
+                low, high = np.append(low, low[-1]), np.append(high, high[-1])
+            a, b = low[0::2], low[1::2]
+            # NaN never wins against a real value, in either direction.
+            low = np.where((y[b] < y[a]) | np.isnan(y[a]), b, a)
+            a, b = high[0::2], high[1::2]
+            high = np.where((y[b] > y[a]) | np.isnan(y[a]), b, a)
+            self.levels.append((low, high))
+
+    def __len__(self):
+        return len(self.x)
+
+    def __sizeof__(self):
+        # Counted by the shared store, which keeps pyramids within its byte budget.
+        arrays = [self.x, self.y, self.rows] + [index for level in self.levels for index in level]
+        return object.__sizeof__(self) + sum(array.nbytes for array in arrays)
+
+    def query(self, start=None, stop=None, points=2000):
+        #Sorted positions of at most about `points` values with start <= x <= stop.
+        lo = 0 if start is None else int(np.searchsorted(self.x, start, side="left"))
+        hi = len(self.x) if stop is None else int(np.searchsorted(self.x, stop, side="right"))
+        count = hi - lo
+        if count <= points:
+            return np.arange(lo, hi)
+        # Each bucket contributes its minimum and maximum, so points // 2 buckets are enough.
+        level = min(int(np.ceil(np.log2(count / max(points // 2, 1)))), len(self.levels)) - 1
+        size = 2 ** (level + 1)
+        low, high = self.levels[level]
+        first, last = lo // size, (hi - 1) // size + 1
+        positions = np.unique(np.concatenate([[lo, hi - 1], low[first:last], high[first:last]]))
+        return positions[(positions >= lo) & (positions < hi)]
+
+    def x_values(self, positions, labels=None):
+        if self.kind == "datetime":
+            return pd.to_datetime(self.x[positions])
+        if self.kind == "position" and labels is not None:
+            return labels.iloc[self.rows[positions]]
+        return self.x[positions]
+
+
+@shared_cache("line_pyramid", show_spinner="Indexing series...")
+def line_pyramid(fingerprint, _df, x, y):
+    #Shared by every session plotting the same dataset, keyed by content fingerprint and bounded by the store's size.
+    xs, kind = _line_axis(_df[x])
+    return LinePyramid(xs, _df[y].to_numpy(dtype=np.float64, na_value=np.nan), kind)
+
+
+def _resample(pyramid, lo, hi, buckets):
+    #Mean per fixed-width time bucket, the numpy equivalent of Series.resample(rule).mean() without the index.
+    x, y = pyramid.x[lo:hi], pyramid.y[lo:hi]
+    finite = np.isfinite(y)
+    x, y = x[finite], y[finite]
+    if len(x) == 0:
+        # Nothing but gaps in range, an empty trace rather than an error.
+        return pd.to_datetime(x), y
+    width = max((x[-1] - x[0]) // buckets + 1, 1)
+    bucket = (x - x[0]) // width
+    counts = np.bincount(bucket)
+    present = counts > 0
+    means = np.bincount(bucket, weights=y)[present] / counts[present]
+    return pd.to_datetime(x[0] + np.flatnonzero(present) * width + width // 2), means
+
+
+def downsampled_lines(fingerprint, df, x, y_cols, x_range=None, points=2000, method="Min/max"):
+    """go.Figure of `y_cols` against `x` with at most about `points` points per series.
+
+    `method` is "Min/max" (every extreme of the pyramid level is kept),
+    "LTTB" (applied to a min/max level four times denser than needed) or,
+    for datetime x, "Resample mean". Returns the figure and the number of
+    points sent.
+    """
+    fig = go.Figure()
+    sent = 0
+    start, stop = x_range if x_range is not None else (None, None)
+    if pd.api.types.is_datetime64_any_dtype(df[x]) and x_range is not None:
+        start, stop = _wall_time(start), _wall_time(stop)
+    for y in y_cols:
+        pyramid = line_pyramid(fingerprint, df, x, y)
+        if method == "Resample mean" and pyramid.kind == "datetime":
+            lo = 0 if start is None else int(np.searchsorted(pyramid.x, start, side="left"))
+            hi = len(pyramid) if stop is None else int(np.searchsorted(pyramid.x, stop, side="right"))
+            if hi - lo > points:
+                xs, ys = _resample(pyramid, lo, hi, points)
+                fig.add_trace(go.Scattergl(x=xs, y=ys, mode="lines", name=y))
+                sent += len(ys)
+                continue
+        if method == "LTTB":
+            positions = pyramid.query(start, stop, points * 4)
+            positions = positions[np.isfinite(pyramid.y[positions])]
+            positions = positions[lttb(pyramid.x[positions], pyramid.y[positions], points)]
+        else:
+            positions = pyramid.query(start, stop, points)
+        labels = df[x] if pyramid.kind == "position" else None
+        fig.add_trace(go.Scattergl(x=pyramid.x_values(positions, labels), y=pyramid.y[positions], mode="lines", name=y))
+        sent += len(positions)
+    return fig, sent
+
+
+def zoom_slider(df, x):
+    #Range slider over the x column; each move reruns the page and re-queries the pyramid at the new range.
+    values = df[x]
+    if pd.api.types.is_datetime64_any_dtype(values):
+        # Local wall time, as the pyramid indexes it and the chart shows it.
+        low, high = (pd.Timestamp(_wall_time(value)).to_pydatetime() for value in (values.min(), values.max()))
+    elif pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        low, high = float(values.min()), float(values.max())
+    else:
+        low, high = 0, len(values) - 1
+    if not low < high:
+        return None
+    step = (high - low) / 1000 if not isinstance(low, int) else max((high - low) // 1000, 1)
+    return st.slider("Zoom", low, high, (low, high), step=step,
+                     help="Narrow the x range, the visible window is re-queried at full detail")
+
+
+def histogram_trace(values, bins=30, name=None):
+    #Bin counts computed here, plotly only receives one bar per bin.
+    values = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    counts, edges = np.histogram(values[np.isfinite(values)], bins=bins)
+    return go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges), name=name,
+                  customdata=np.stack([edges[:-1], edges[1:]], axis=1),
+                  hovertemplate="%{customdata[0]:.4g} to %{customdata[1]:.4g}<br>count: %{y:,}<extra></extra>")
+
+
+def box_stats(values, by=None, max_outliers=2000):
+    """Tukey box statistics per group and the points outside the whiskers.
+
+    Values are sorted once by (group, value), so quartiles (linear
+    interpolation, as in pandas), 1.5 IQR whiskers and means come out of
+    a handful of vectorized passes. Returns a frame indexed by group with
+    q1, median, q3, lowerfence, upperfence, mean and count, and a frame of
+    the `max_outliers` most extreme outliers with their group and value.
+    """
+    numbers = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    if by is None:
+        codes, names = np.zeros(len(numbers), dtype=np.int64), pd.Index([values.name])
+    else:
+        codes, names = pd.factorize(by, use_na_sentinel=False)
+        names = pd.Index(names).astype(str)
+    finite = np.isfinite(numbers)
+    codes, numbers = codes[finite], numbers[finite]
+    order = np.lexsort((numbers, codes))
+    codes, numbers = codes[order], numbers[order]
+    counts = np.bincount(codes, minlength=len(names))
+    present = np.flatnonzero(counts)
+    counts = counts[present]
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+    table = {}
+    for label, q in [("q1", 0.25), ("median", 0.5), ("q3", 0.75)]:
+        position = starts + q * (counts - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        table[label] = numbers[lower] + (numbers[upper] - numbers[lower]) * (position - lower)
+    iqr = table["q3"] - table["q1"]
+    group = np.repeat(np.arange(len(present)), counts)
+    low_limit, high_limit = table["q1"] - 1.5 * iqr, table["q3"] + 1.5 * iqr
+    inside = (numbers >= low_limit[group]) & (numbers <= high_limit[group])
+    if len(numbers):
+        table["lowerfence"] = np.minimum.reduceat(np.where(inside, numbers, np.inf), starts)
+        table["upperfence"] = np.maximum.reduceat(np.where(inside, numbers, -np.inf), starts)
+        table["mean"] = np.add.reduceat(numbers, starts) / counts
+    else:
+        table["lowerfence"] = table["upperfence"] = table["mean"] = np.empty(0)
+    table["count"] = counts
+    stats = pd.DataFrame(table, index=names[present])
+
+    # Only the most extreme outliers are kept, measured in IQRs beyond their group's fence.
+    outside = np.flatnonzero(~inside)
+    distance = np.maximum(low_limit[group[outside]] - numbers[outside], numbers[outside] - high_limit[group[outside]])
+    distance /= np.where(iqr[group[outside]] > 0, iqr[group[outside]], 1)
+    outside = outside[np.argsort(distance, kind="stable")[::-1][:max_outliers]]
+    outliers = pd.DataFrame({"group": stats.index[group[outside]], "value": numbers[outside]})
+    return stats, outliers
+
+
+def box_figure(stats, outliers, horizontal=False, title=None):
+    #Precomputed boxes plus a marker trace with only the outliers.
+    box = dict(name="", q1=stats["q1"], median=stats["median"], q3=stats["q3"], lowerfence=stats["lowerfence"],
+               upperfence=stats["upperfence"], mean=stats["mean"], boxpoints=False, showlegend=False)
+    points = dict(mode="markers", name="outliers", marker={"size": 4, "color": "#EF553B"}, showlegend=False)
+    fig = go.Figure()
+    if horizontal:
+        fig.add_trace(go.Box(y=stats.index, orientation="h", **box))
+        fig.add_trace(go.Scattergl(x=outliers["value"], y=outliers["group"], **points))
+    else:
+        fig.add_trace(go.Box(x=stats.index, **box))
+        fig.add_trace(go.Scattergl(x=outliers["group"], y=outliers["value"], **points))
+    fig.update_layout(title=title)
+    return fig
+
+
+@st.cache_data(max_entries=16, show_spinner="Summarising distributions...")
+def column_boxes(fingerprint, _df, max_outliers=2000):
+    #One box per numeric column, memoized per dataset fingerprint.
+    stats, outliers = [], []
+    for name in _df.select_dtypes(include=['number']).columns:
+        column_stats, column_outliers = box_stats(_df[name], max_outliers=max_outliers)
+        stats.append(column_stats)
+        outliers.append(column_outliers)
+    if not stats:
+        return None
+    return box_figure(pd.concat(stats), pd.concat(outliers, ignore_index=True), title="Boxplot of Numeric Values")
+
+
+def bar_sums(df, x, y):
+    #Sum of y per distinct x with one factorize and one bincount, in order of first appearance.
+    codes, uniques = pd.factorize(df[x])
+    values = df[y].to_numpy(dtype=np.float64, na_value=np.nan)
+    keep = codes >= 0
+    sums = np.bincount(codes[keep], weights=np.nan_to_num(values[keep]), minlength=len(uniques))
+    return pd.DataFrame({x: uniques, y: sums})
+
+
+PANEL_BINS = 40
+PANEL_SCATTER_ROWS = 5000
+
+
+def pair_panel(x, y=None, bins=PANEL_BINS, scatter_rows=PANEL_SCATTER_ROWS, size=2.2):
+    """PNG of one pairplot cell: a 1-D histogram when `y` is None, otherwise x against y.
+
+    Off-diagonal cells scatter every point of small columns and draw a
+    log-scaled 2-D histogram otherwise, so rendering time does not depend
+    on the row count. Uses the object-oriented matplotlib API, which is
+    safe to call from several script threads at once.
+    """
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(size, size), dpi=80)
+    ax = fig.add_subplot()
+    xs = x.to_numpy(dtype=np.float64, na_value=np.nan)
+    if y is None:
+        counts, edges = np.histogram(xs[np.isfinite(xs)], bins=bins)
+        ax.stairs(counts, edges, fill=True, color="#636EFA")
+    else:
+        ys = y.to_numpy(dtype=np.float64, na_value=np.nan)
+        finite = np.isfinite(xs) & np.isfinite(ys)
+        xs, ys = xs[finite], ys[finite]
+        if len(xs) <= scatter_rows:
+            ax.scatter(xs, ys, s=3, alpha=0.5, color="#636EFA", linewidths=0)
+        elif len(xs):
+            counts, x_edges, y_edges = np.histogram2d(xs, ys, bins=bins)
+            ax.pcolormesh(x_edges, y_edges, np.ma.masked_equal(np.log1p(counts), 0).T, cmap="Blues")
+    ax.set_xlabel(x.name, fontsize=8)
+    ax.set_ylabel(y.name if y is not None else "count", fontsize=8)
+    ax.tick_params(labelsize=6)
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+def pairplot_grid(fingerprint, df, columns, store):
+    """Pairplot of `columns` drawn panel by panel into a grid of placeholders.
+
+    Panels already in the artifact store are shown first; the missing ones
+    are rendered one at a time, stored under a key made of the dataset
+    fingerprint, the column pair and the panel settings, and shown as soon
+    as each is ready.
+    """
+    slots = {}
+    for y in columns:
+        for cell, x in zip(st.columns(len(columns)), columns):
+            slots[(x, y)] = cell.empty()
+    missing = []
+    for (x, y), slot in slots.items():
+        key = store.key(fingerprint, "pair_panel", x, None if x == y else y, PANEL_BINS, PANEL_SCATTER_ROWS)
+        image = store.get(key, ".png")
+        if image is None:
+            missing.append((x, y, key))
+        else:
+            slot.image(image)
+    progress = st.progress(0.0, "Rendering pairplot...") if missing else None
+    for done, (x, y, key) in enumerate(missing, start=1):
+        image = pair_panel(df[x], None if x == y else df[y])
+        store.put(key, ".png", image)
+        slots[(x, y)].image(image)
+        progress.progress(done / len(missing), f"Rendering pairplot... {done}/{len(missing)}")
+    if progress is not None:
+        progress.empty()
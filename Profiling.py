@@ -0,0 +1,177 @@
+import json
+import os
+import sys
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import pandas as pd
+import streamlit as st
+
+from Functions import SpawnPool
+from Store import ArtifactStore
+
+PROFILE_DIR = Path("outputs/profiles")
+
+
+def profile_config(df, columns=None, minimal=False, sample_rows=None):
+    #Everything that changes the report; together with the dataset fingerprint it names the HTML file.
+    columns = None if columns is None or list(columns) == df.columns.tolist() else tuple(columns)
+    sample_rows = sample_rows if sample_rows and sample_rows < len(df) else None
+    return {"columns": columns, "minimal": minimal, "sample_rows": sample_rows}
+
+
+def _progress_bar(progress_path):
+    # ydata-profiling drives tqdm bars; this one writes each step to a small JSON file the app polls.
+    from tqdm.auto import tqdm
+
+    class FileProgress(tqdm):
+        def __init__(self, *args, **kwargs):
+            self._devnull = kwargs["file"] = open(os.devnull, "w")
+            super().__init__(*args, **kwargs)
+
+        def close(self):
+            super().close()
+            self._devnull.close()
+
+        def update(self, n=1):
+            displayed = super().update(n)
+            tmp = progress_path.with_name(progress_path.name + ".tmp")
+            tmp.write_text(json.dumps({"step": self.desc, "done": self.n, "total": self.total or 0}))
+            os.replace(tmp, progress_path)
+            return displayed
+
+    return FileProgress
+
+
+def _build_profile(data_path, title, minimal, output_path, progress_path):
+    """Worker process: read the prepared dataset, profile it and write the HTML next to it."""
+    import pyarrow.feather as feather
+    from ydata_profiling import ProfileReport
+
+    data_path, output_path, progress_path = Path(data_path), Path(output_path), Path(progress_path)
+    FileProgress = _progress_bar(progress_path)
+    try:
+        import ydata_profiling.model.describe
+        import ydata_profiling.report.structure.report
+    except ImportError:
+        pass
+    for name, module in list(sys.modules.items()):
+        if name.startswith("ydata_profiling") and hasattr(module, "tqdm"):
+            module.tqdm = FileProgress
+    if data_path.suffix == ".arrow":
+        df = feather.read_table(data_path, memory_map=True).to_pandas(split_blocks=True)
+    else:
+        df = pd.read_pickle(data_path)
+    report = ProfileReport(df, title=title, minimal=minimal, progress_bar=True)
+    tmp = output_path.with_name(output_path.name + ".tmp")
+    report.to_file(tmp, silent=True)
+    os.replace(tmp, output_path)
+    return str(output_path)
+
+
+class ProfileJobs:
+    """Profiles built in a background process pool and kept on disk.
+
+    A report is identified by the dataset fingerprint and its config, so a
+    dataset that was profiled once, in any session, opens instantly and
+    concurrent requests for the same report share one job. The input is
+    handed to the worker as an Arrow file (the DatasetCache file itself
+    when the whole dataset is profiled), never pickled through the pool.
+    A pool broken by a dead worker is replaced on the next submit.
+    """
+
+    def __init__(self, directory=PROFILE_DIR, workers=1, max_bytes=2 * 1024**3):
+        self.store = ArtifactStore(directory, max_bytes)
+        self.workers = workers
+        self.pool = SpawnPool(workers)
+        self.jobs = {}
+        self.inputs = {}
+        # Reentrant, a job that is already done runs its done callback inside submit().
+        self._lock = threading.RLock()
+
+    def key(self, fingerprint, config):
+        return self.store.key(fingerprint, "profile", config)
+
+    def report(self, key):
+        path = self.store.path(key, ".html")
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def _input(self, key, fingerprint, df, config):
+        from Loader import DatasetCache
+        cached = DatasetCache().path(fingerprint)
+        if config["columns"] is None and config["sample_rows"] is None and cached.exists():
+            return cached
+        if config["columns"] is not None:
+            df = df[list(config["columns"])]
+        if config["sample_rows"] is not None:
+            df = df.sample(config["sample_rows"], random_state=0).sort_index()
+        path = self.store.path(key, ".arrow")
+        try:
+            df.reset_index(drop=True).to_feather(path)
+        except Exception:
+            # Mixed-type object columns cannot be written to Arrow.
+            path = self.store.path(key, ".pkl")
+            df.to_pickle(path)
+        return path
+
+    def submit(self, fingerprint, df, config, title):
+        key = self.key(fingerprint, config)
+        with self._lock:
+            job = self.jobs.get(key)
+            if self.report(key) is None and (job is None or (job.done() and job.exception() is not None)):
+                data_path = self._input(key, fingerprint, df, config)
+                args = (_build_profile, str(data_path), title, config["minimal"],
+                        str(self.store.path(key, ".html")), str(self.store.path(key, ".progress")))
+                try:
+                    job = self.pool.submit(*args)
+                except BrokenProcessPool:
+                    # A worker died (e.g. killed for memory), the pool takes no more work until it is replaced.
+                    self.pool.shutdown(wait=False, cancel_futures=True)
+                    self.pool = SpawnPool(self.workers)
+                    job = self.pool.submit(*args)
+                self.jobs[key] = job
+                self.inputs[key] = data_path
+                job.add_done_callback(lambda done: self._cleanup(key, data_path, done))
+        return key
+
+    def _cleanup(self, key, data_path, job):
+        with self._lock:
+            if self.jobs.get(key) is not job:
+                # A retry of the same report already reuses these paths.
+                return
+            self.inputs.pop(key, None)
+            if data_path.parent == self.store.directory:
+                data_path.unlink(missing_ok=True)
+            self.store.path(key, ".progress").unlink(missing_ok=True)
+            # Inputs of jobs still queued or running are not the evictor's to take.
+            keep = set(self.inputs.values()) | {self.store.path(k, ".progress") for k in self.inputs}
+            self.store.evict(keep)
+
+    def status(self, key):
+        """("done" | "running" | "failed" | "missing", progress 0..1, message)."""
+        if self.report(key) is not None:
+            return "done", 1.0, "Report ready"
+        with self._lock:
+            job = self.jobs.get(key)
+        if job is None:
+            return "missing", 0.0, ""
+        if job.done() and job.exception() is not None:
+            return "failed", 0.0, str(job.exception())
+        try:
+            progress = json.loads(self.store.path(key, ".progress").read_text())
+        except (FileNotFoundError, ValueError):
+            return "running", 0.0, "Starting profiler..."
+        fraction = progress["done"] / progress["total"] if progress["total"] else 0.0
+        return "running", min(fraction, 0.99), f"{progress['step']} ({progress['done']}/{progress['total']})"
+
+
+@st.cache_resource
+def profile_jobs():
+    from Functions import setting
+    return ProfileJobs(workers=setting("profiling", "workers", 1),
+                       max_bytes=int(setting("profiling", "max_mb", 2048) * 1024**2))
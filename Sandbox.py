@@ -0,0 +1,238 @@
+import contextlib
+import io
+import os
+import threading
+import traceback
+import uuid
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import pandas as pd
+import streamlit as st
+
+from Functions import SpawnPool
+
+SANDBOX_DIR = Path("outputs/sandbox")
+
+
+# --- Recorder class to persist st calls with unique keys for plotly charts ---
+class StreamlitCallRecorder:
+    def __init__(self):
+        self.calls = []
+        self.chart_counter = 0  # Counter for generating unique keys
+
+    def _record(self, method, *args, **kwargs):
+        # For plotly_chart, ensure a unique key is provided
+        if method == "plotly_chart" and "key" not in kwargs:
+            # Generate a unique key using chart counter
+            self.chart_counter += 1
+            kwargs["key"] = f"chart_{self.chart_counter}_{uuid.uuid4().hex[:8]}"
+
+        self.calls.append((method, args, kwargs))
+
+    def write(self, *args, **kwargs): self._record("write", *args, **kwargs)
+    def dataframe(self, *args, **kwargs): self._record("dataframe", *args, **kwargs)
+    def table(self, *args, **kwargs): self._record("table", *args, **kwargs)
+    def plotly_chart(self, *args, **kwargs): self._record("plotly_chart", *args, **kwargs)
+    def pyplot(self, *args, **kwargs): self._record("pyplot", *args, **kwargs)
+    def markdown(self, *args, **kwargs): self._record("markdown", *args, **kwargs)
+    def subheader(self, *args, **kwargs): self._record("subheader", *args, **kwargs)
+    def text(self, *args, **kwargs): self._record("text", *args, **kwargs)
+    def json(self, *args, **kwargs): self._record("json", *args, **kwargs)
+    def line_chart(self, *args, **kwargs): self._record("line_chart", *args, **kwargs)
+    def bar_chart(self, *args, **kwargs): self._record("bar_chart", *args, **kwargs)
+    def area_chart(self, *args, **kwargs): self._record("area_chart", *args, **kwargs)
+
+    def get_calls(self):
+        return self.calls
+
+
+def replay(calls):
+    #Draw recorded calls on the current Streamlit container.
+    for method, args, kwargs in calls:
+        if hasattr(st, method):
+            try:
+                getattr(st, method)(*args, **kwargs)
+            except Exception as e:
+                st.error(f"Error executing {method}: {str(e)}")
+
+
+# --- Worker process side ---
+_DATASET = {}
+
+
+def _warm_up():
+    #Runs once per worker, so snippets never pay for these imports.
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    import matplotlib.pyplot
+    import numpy
+    import plotly.express
+    import plotly.graph_objects
+    import seaborn
+
+
+def _dataset(data_path):
+    # One dataset per worker, memory-mapped from the Arrow file and reused until another one is asked for.
+    # Files are only ever replaced, never rewritten, so the inode tells versions apart (mtime is the LRU clock).
+    stamp = (data_path, os.stat(data_path).st_ino)
+    if _DATASET.get("stamp") != stamp:
+        _DATASET.clear()
+        if data_path.endswith(".arrow"):
+            import pyarrow.feather as feather
+            df = feather.read_table(data_path, memory_map=True).to_pandas(split_blocks=True)
+        else:
+            df = pd.read_pickle(data_path)
+        _DATASET.update(stamp=stamp, df=df)
+    return _DATASET["df"]
+
+
+def _cpu_exceeded(signum, frame):
+    raise TimeoutError("CPU time limit exceeded")
+
+
+@contextlib.contextmanager
+def _limits(cpu_seconds, memory_bytes):
+    """CPU time and address space limits for one call, on top of what the worker already uses."""
+    try:
+        import resource
+        import signal
+    except ImportError:
+        # No rlimits on this platform, the wall clock timeout in SandboxPool still applies.
+        yield
+        return
+    used = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_used = int(used.ru_utime + used.ru_stime)
+    with open("/proc/self/statm") as statm:
+        address_space = int(statm.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    signal.signal(signal.SIGXCPU, _cpu_exceeded)
+    cpu_hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+    memory_hard = resource.getrlimit(resource.RLIMIT_AS)[1]
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_used + cpu_seconds, cpu_hard))
+    resource.setrlimit(resource.RLIMIT_AS, (address_space + memory_bytes, memory_hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_hard, memory_hard))
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_hard, cpu_hard))
+
+
+def _execute(data_path, code, cpu_seconds, memory_bytes):
+    """Worker process: run one snippet against the dataset and return (stdout, recorded calls, error)."""
+    import matplotlib.pyplot as plt
+    import numpy as np
+    import plotly.express as px
+    import plotly.graph_objects as go
+    import seaborn as sns
+
+    output_buffer = io.StringIO()
+    recorder = StreamlitCallRecorder()
+    error = None
+    namespace = {
+        # A shallow copy, so columns added or dropped by one snippet do not leak into the next.
+        "df": _dataset(data_path).copy(deep=False),
+        "px": px,
+        "sns": sns,
+        "plt": plt,
+        "pd": pd,
+        "np": np,
+        "go": go,
+        "st": recorder  # Redirect all st.* calls to the recorder
+    }
+    try:
+        with _limits(cpu_seconds, memory_bytes), contextlib.redirect_stdout(output_buffer):
+            # One dict for globals and locals, so functions and comprehensions in the snippet see its names.
+            exec(code, namespace)
+    except BaseException:
+        error = traceback.format_exc()
+    finally:
+        plt.close("all")
+    return output_buffer.getvalue(), recorder.get_calls(), error
+
+
+# --- App side ---
+class SandboxPool:
+    """Warm worker processes that run generated code away from the server.
+
+    Each worker imports pandas, plotly, matplotlib and seaborn once and
+    memory-maps the dataset from its DatasetCache Arrow file, so only the
+    code goes in and only the recorded st.* calls come back. A call gets
+    `cpu_seconds` of CPU time and `memory_bytes` of extra address space;
+    a call that is still running after `timeout` seconds (e.g. sleeping)
+    has the workers replaced, which fails the calls running beside it.
+    """
+
+    def __init__(self, workers=2, cpu_seconds=30, memory_bytes=2 * 1024**3, timeout=60, directory=SANDBOX_DIR):
+        self.workers = workers
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = memory_bytes
+        self.timeout = timeout
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._start()
+
+    def _start(self):
+        self.pool = SpawnPool(self.workers, initializer=_warm_up)
+        # Start every worker now instead of on the first snippets.
+        for _ in range(self.workers):
+            self.pool.submit(int)
+
+    def restart(self, pool):
+        with self._lock:
+            if pool is not self.pool:
+                return
+            for process in list((pool._processes or {}).values()):
+                process.terminate()
+            pool.shutdown(wait=False, cancel_futures=True)
+            self._start()
+
+    def dataset(self, fingerprint, df):
+        """Path of a file the workers can load the dataset from without it being pickled per call."""
+        from Loader import DatasetCache, evict_files
+        cache = DatasetCache()
+        if fingerprint in cache or cache.save(fingerprint, df):
+            return cache.path(fingerprint)
+        # Mixed-type object columns cannot be written to Arrow, they go through one pickle file instead,
+        # kept under the Arrow cache's byte cap the same least-recently-used way.
+        path = self.directory / f"{fingerprint}.pkl"
+        if path.exists():
+            os.utime(path)
+        else:
+            tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+            df.to_pickle(tmp)
+            os.replace(tmp, path)
+            evict_files(self.directory.glob("*.pkl"), cache.max_bytes, keep=path)
+        return path
+
+    def submit(self, fingerprint, df, code):
+        pool = self.pool
+        future = pool.submit(_execute, str(self.dataset(fingerprint, df)), code, self.cpu_seconds,
+                             self.memory_bytes)
+        future.pool = pool
+        return future
+
+    def result(self, future):
+        """(stdout, recorded calls, error) of a submitted snippet, waiting at most `timeout` seconds."""
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            self.restart(future.pool)
+            return "", [], f"Execution stopped after {self.timeout} seconds."
+        except BrokenProcessPool:
+            self.restart(future.pool)
+            return "", [], "The worker running this code stopped unexpectedly."
+        except Exception:
+            # e.g. a recorded object that cannot be sent back from the worker
+            return "", [], traceback.format_exc()
+
+    def run(self, fingerprint, df, code):
+        return self.result(self.submit(fingerprint, df, code))
+
+
+@st.cache_resource
+def sandbox_pool():
+    from Functions import setting
+    return SandboxPool(workers=setting("sandbox", "workers", 2),
+                       cpu_seconds=setting("sandbox", "cpu_seconds", 30),
+                       memory_bytes=int(setting("sandbox", "memory_mb", 2048) * 1024**2),
+                       timeout=setting("sandbox", "timeout", 60))
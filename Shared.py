@@ -0,0 +1,202 @@
+import dataclasses
+import functools
+import inspect
+import sys
+import threading
+import time
+import weakref
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+
+def sizeof(value):
+    """Approximate memory held by a value, counting frames and arrays by their buffers."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (str, bytes)):
+        return sys.getsizeof(value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return sum(sizeof(getattr(value, field.name)) for field in dataclasses.fields(value))
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(sizeof(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(key) + sizeof(item) for key, item in value.items())
+    return sys.getsizeof(value)
+
+
+@dataclasses.dataclass
+class _Entry:
+    value: object
+    size: int
+    pinned: bool
+    sessions: set = dataclasses.field(default_factory=set)
+    accessed: float = dataclasses.field(default_factory=time.monotonic)
+
+
+class SharedStore:
+    """Process-wide store of datasets and derived artifacts, one copy per content key.
+
+    Keys are content fingerprints (DatasetCache keys) or tuples of an
+    artifact kind, a fingerprint and its parameters, so ten sessions on the
+    same data share one frame and one set of statistics. Each entry
+    records the sessions referencing it. Past `max_bytes`, entries nobody
+    references go first, least recently used first, then derived artifacts
+    (they can be recomputed); a `pinned` entry, a session's dataset, stays
+    while any session holds it. Values are shared and must not be mutated.
+    """
+
+    def __init__(self, max_bytes=4 * 1024**3):
+        self.max_bytes = max_bytes
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._building = {}
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, create=None, session=None, pinned=False):
+        """The stored value for `key`, built once with `create()` when missing (None is not stored)."""
+        with self._lock:
+            entry = self._touch(key, session)
+            if entry is not None or create is None:
+                return entry.value if entry is not None else None
+            building = self._building.setdefault(key, threading.Lock())
+        # Concurrent sessions asking for the same key wait for one build instead of running their own.
+        with building:
+            with self._lock:
+                entry = self._touch(key, session)
+            if entry is not None:
+                return entry.value
+            try:
+                value = create()
+                if value is not None:
+                    with self._lock:
+                        self._entries[key] = _Entry(value, sizeof(value), pinned, {session} - {None})
+                        self._evict()
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
+            return value
+
+    def _touch(self, key, session):
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.accessed = time.monotonic()
+            if session is not None:
+                entry.sessions.add(session)
+        return entry
+
+    def usage(self, key):
+        """(value, bytes, sessions referencing it) of a stored key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else (entry.value, entry.size, len(entry.sessions))
+
+    def replace(self, key, value, size=None):
+        #Swap a stored value for an equivalent one, e.g. a memory-mapped copy of the same frame that only costs `size`.
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.value, entry.size = value, sizeof(value) if size is None else size
+
+    def release(self, key, session):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.sessions.discard(session)
+                self._evict()
+
+    def release_session(self, session):
+        with self._lock:
+            for entry in self._entries.values():
+                entry.sessions.discard(session)
+            self._evict()
+
+    def _evict(self):
+        total = sum(entry.size for entry in self._entries.values())
+        by_age = sorted(self._entries.items(), key=lambda item: item[1].accessed)
+        for can_drop in (lambda entry: not entry.sessions, lambda entry: not entry.pinned):
+            for key, entry in by_age:
+                if total <= self.max_bytes:
+                    return
+                if key in self._entries and can_drop(entry):
+                    del self._entries[key]
+                    total -= entry.size
+
+    def stats(self):
+        with self._lock:
+            entries = list(self._entries.values())
+        return {
+            "entries": len(entries),
+            "datasets": sum(entry.pinned for entry in entries),
+            "bytes": sum(entry.size for entry in entries),
+            "sessions": len(set().union(*(entry.sessions for entry in entries))),
+        }
+
+
+@st.cache_resource
+def shared_store():
+    from Functions import setting
+    return SharedStore(int(setting("shared", "max_mb", 4096) * 1024**2))
+
+
+class _SessionToken:
+    pass
+
+
+def session_id():
+    """Id of the current browser session; its references are released when the session state is dropped."""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return None
+    if "shared_token" not in st.session_state:
+        token = _SessionToken()
+        weakref.finalize(token, shared_store().release_session, ctx.session_id)
+        st.session_state.shared_token = token
+    return ctx.session_id
+
+
+def session_dataset(key, create):
+    """The process-wide frame for `key`; this session's reference moves to it from its previous dataset."""
+    store, session = shared_store(), session_id()
+    df = store.get(key, create, session, pinned=True)
+    previous = st.session_state.get("shared_dataset")
+    if df is not None and previous != key:
+        if previous is not None:
+            store.release(previous, session)
+        st.session_state.shared_dataset = key
+    return df
+
+
+def shared_cache(kind, show_spinner=None):
+    """Like st.cache_data keyed by fingerprint, but every session gets the same stored object.
+
+    Arguments whose names start with an underscore are left out of the key,
+    as with Streamlit's caches.
+    """
+    def decorate(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (kind,) + tuple((name, value) for name, value in bound.arguments.items()
+                                  if not name.startswith("_"))
+
+            def create():
+                if show_spinner:
+                    with st.spinner(show_spinner):
+                        return func(*args, **kwargs)
+                return func(*args, **kwargs)
+
+            return shared_store().get(key, create, session_id())
+        return wrapper
+    return decorate
@@ -0,0 +1,251 @@
+import math
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from Shared import shared_cache
+from Sketches import DatasetSketch
+
+QUANTILES = [0.25, 0.5, 0.75]
+BLOCK_BYTES = 64 * 1024**2
+TOP_VALUES = 5
+SKETCH_CHUNK_ROWS = 500_000
+
+
+@dataclass
+class DatasetStats:
+    """Everything the LLM context and the Overview page need to know about a frame.
+
+    `numeric` has one row per numeric column with the same statistics as
+    `DataFrame.describe()`; `columns` has dtype, null and distinct counts
+    for every column; `top_values` maps each non-numeric column to its most
+    frequent values and `top_rows` holds the most frequent whole rows.
+    """
+    shape: tuple
+    head: pd.DataFrame
+    columns: pd.DataFrame
+    numeric: pd.DataFrame
+    top_values: dict = field(default_factory=dict)
+    top_rows: pd.DataFrame = None
+    duplicate_rows: int = 0
+    error_bounds: dict = None
+
+    @property
+    def numerical_columns(self):
+        return self.numeric.index.tolist()
+
+    @property
+    def categorical_columns(self):
+        return [c for c in self.columns.index if c not in self.numeric.index]
+
+    def summary(self):
+        #One row per column for display, numeric statistics joined onto the column facts.
+        table = self.columns.join(self.numeric[["mean", "std", "min", "50%", "max"]])
+        table["top value"] = pd.Series({c: str(values[0][0]) for c, values in self.top_values.items() if values}, dtype=object)
+        return table
+
+    def duplicates(self):
+        #Duplicate row count for display, with its error bound when it was estimated.
+        if not self.error_bounds:
+            return f"{self.duplicate_rows:,}"
+        return f"~{self.duplicate_rows:,} ± {self.error_bounds['duplicate_rows']:,}"
+
+    def approximation_note(self):
+        if not self.error_bounds:
+            return ""
+        bounds = self.error_bounds
+        return (f"Note: statistics are estimated from sketches. Unique counts are within about "
+                f"{bounds['distinct']:.1%}, duplicate rows within {bounds['duplicate_rows']:,}, quartiles "
+                f"within {bounds['quantile_rank']:.1%} of rank and frequencies overstate by at most "
+                f"{bounds['frequency']:,} rows.")
+
+
+def block_columns(rows, budget=BLOCK_BYTES):
+    #Columns per float64 block so one block stays within `budget` bytes, the scratch arrays are a few times that.
+    return max(1, budget // max(8 * rows, 1))
+
+
+def _numeric_block(block):
+    # One sort per block gives min, max, quantiles and distinct counts; NaNs sort to the end.
+    values = block.to_numpy(dtype="float64", na_value=np.nan)
+    missing = np.isnan(values)
+    count = (~missing).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        total = np.where(missing, 0, values).sum(axis=0)
+        mean = total / count
+        squares = np.where(missing, 0, (values - mean) ** 2).sum(axis=0)
+        std = np.sqrt(squares / (count - 1))
+    ordered = np.sort(values, axis=0)
+    last = np.maximum(count - 1, 0)
+    stats = {"count": count, "mean": mean, "std": std, "min": ordered[0]}
+    for q in QUANTILES:
+        position = q * last
+        lower = np.floor(position).astype(int)
+        upper = np.ceil(position).astype(int)
+        low = np.take_along_axis(ordered, lower[None, :], axis=0)[0]
+        high = np.take_along_axis(ordered, upper[None, :], axis=0)[0]
+        stats[f"{q:.0%}"] = low + (high - low) * (position - lower)
+    stats["max"] = np.take_along_axis(ordered, last[None, :], axis=0)[0]
+    changes = (ordered[1:] != ordered[:-1]) & ~np.isnan(ordered[1:])
+    unique = np.where(count > 0, changes.sum(axis=0) + 1, 0)
+    empty = count == 0
+    for key in ["mean", "min", "25%", "50%", "75%", "max"]:
+        stats[key] = np.where(empty, np.nan, stats[key])
+    table = pd.DataFrame(stats, index=block.columns)
+    return table, pd.Series(len(values) - count, index=block.columns), pd.Series(unique, index=block.columns)
+
+
+def _factorize(column):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(), column.cat.categories
+    try:
+        return pd.factorize(column, use_na_sentinel=True)
+    except TypeError:
+        # Unhashable cells (lists or dicts from JSON) are compared by their text form.
+        return pd.factorize(column.astype(str).where(column.notna()), use_na_sentinel=True)
+
+
+def _other_column(column):
+    codes, uniques = _factorize(column)
+    present = codes[codes >= 0]
+    counts = np.bincount(present, minlength=len(uniques))
+    top = np.argsort(counts)[::-1][:TOP_VALUES]
+    top_values = [(uniques[i], int(counts[i])) for i in top if counts[i] > 0]
+    return len(codes) - len(present), int((counts > 0).sum()), top_values
+
+
+def _row_frequencies(df):
+    # Rows are compared by a 64-bit hash, so duplicates and value counts share one factorize.
+    if df.shape[1] == 0 or len(df) == 0:
+        return 0, df.head(0)
+    try:
+        hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    except TypeError:
+        hashes = pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy()
+    codes, uniques = pd.factorize(hashes)
+    counts = np.bincount(codes)
+    first = np.empty(len(uniques), dtype=np.int64)
+    first[codes[::-1]] = np.arange(len(codes) - 1, -1, -1)
+    top = np.argsort(counts, kind="stable")[::-1][:TOP_VALUES]
+    top_rows = df.iloc[first[top]].assign(count=counts[top]).reset_index(drop=True)
+    return int(len(codes) - len(uniques)), top_rows
+
+
+def compute_stats(df):
+    numeric_columns = df.select_dtypes(include=['number']).columns
+    numeric_tables, nulls, uniques = [], {}, {}
+    width = block_columns(len(df))
+    for start in range(0, len(numeric_columns), width):
+        table, block_nulls, block_unique = _numeric_block(df[numeric_columns[start:start + width]])
+        numeric_tables.append(table)
+        nulls.update(block_nulls.to_dict())
+        uniques.update(block_unique.to_dict())
+    numeric = pd.concat(numeric_tables) if numeric_tables else pd.DataFrame(
+        columns=["count", "mean", "std", "min", "25%", "50%", "75%", "max"])
+
+    top_values = {}
+    for name in df.columns.difference(numeric_columns, sort=False):
+        nulls[name], uniques[name], top_values[name] = _other_column(df[name])
+
+    columns = pd.DataFrame({
+        "dtype": df.dtypes.astype(str),
+        "non-null": len(df) - pd.Series(nulls, dtype="int64").reindex(df.columns),
+        "nulls": pd.Series(nulls, dtype="int64").reindex(df.columns),
+        "unique": pd.Series(uniques, dtype="int64").reindex(df.columns),
+    })
+    duplicate_rows, top_rows = _row_frequencies(df)
+    return DatasetStats(
+        shape=df.shape,
+        head=df.head(3),
+        columns=columns,
+        numeric=numeric,
+        top_values=top_values,
+        top_rows=top_rows,
+        duplicate_rows=duplicate_rows,
+    )
+
+
+@shared_cache("stats", show_spinner="Computing statistics...")
+def dataset_stats(fingerprint, _df):
+    #Memoized per dataset fingerprint, the frame itself is never hashed.
+    return compute_stats(_df)
+
+
+def sketch_dataset(df, chunk_rows=SKETCH_CHUNK_ROWS):
+    sketch = DatasetSketch()
+    for start in range(0, len(df), chunk_rows):
+        sketch.update(df.iloc[start:start + chunk_rows])
+    return sketch
+
+
+def sketch_stats(sketch, df):
+    """DatasetStats estimated from a DatasetSketch instead of an exact scan.
+
+    Counts, nulls, means, minima and maxima stay exact; distinct counts,
+    quartiles, top values and duplicate rows carry the bounds recorded in
+    `error_bounds`. Duplicates are the row count minus the distinct row
+    estimate, so their bound is the distinct estimate's standard error in
+    rows; an estimate below it cannot be told apart from no duplicates.
+    """
+    numeric, nulls, uniques, top_values = {}, {}, {}, {}
+    distinct_error = quantile_error = frequency_error = 0
+    for name in df.columns:
+        column = sketch.columns.get(name)
+        if column is None:
+            continue
+        nulls[name] = column.nulls
+        uniques[name] = min(column.distinct.estimate(), column.count)
+        distinct_error = column.distinct.error
+        if column.numeric:
+            count = column.count
+            mean = column.mean if count else np.nan
+            variance = column.variance
+            quartiles = column.quantiles.quantiles(QUANTILES)
+            numeric[name] = {
+                "count": count, "mean": mean, "std": np.sqrt(variance),
+                "min": column.quantiles.min if count else np.nan,
+                **{f"{q:.0%}": value for q, value in zip(QUANTILES, quartiles)},
+                "max": column.quantiles.max if count else np.nan,
+            }
+            quantile_error = column.quantiles.error
+        else:
+            top_values[name] = column.frequent.top_values(TOP_VALUES)
+            frequency_error = max(frequency_error, int(column.frequent.cms.error * column.count))
+
+    # Row counts within the Count-Min error could be pure collisions, only confident ones are reported.
+    row_error = int(sketch.frequent_rows.cms.error * sketch.rows)
+    positions = [(int(position), count) for position, count in sketch.frequent_rows.top_values(TOP_VALUES)
+                 if count > row_error]
+    top_rows = df.iloc[[position for position, _ in positions]].assign(
+        count=[count for _, count in positions]).reset_index(drop=True)
+    columns = pd.DataFrame({
+        "dtype": df.dtypes.astype(str),
+        "non-null": len(df) - pd.Series(nulls, dtype="int64").reindex(df.columns),
+        "nulls": pd.Series(nulls, dtype="int64").reindex(df.columns),
+        "unique": pd.Series(uniques, dtype="int64").reindex(df.columns),
+    })
+    distinct_rows = sketch.distinct_rows.estimate()
+    return DatasetStats(
+        shape=df.shape,
+        head=df.head(3),
+        columns=columns,
+        numeric=pd.DataFrame.from_dict(numeric, orient="index",
+                                       columns=["count", "mean", "std", "min", "25%", "50%", "75%", "max"]),
+        top_values=top_values,
+        top_rows=top_rows,
+        duplicate_rows=max(sketch.rows - distinct_rows, 0),
+        error_bounds={
+            "distinct": distinct_error or sketch.distinct_rows.error,
+            "duplicate_rows": int(math.ceil(sketch.distinct_rows.error * min(distinct_rows, sketch.rows))),
+            "quantile_rank": quantile_error,
+            "frequency": max(frequency_error, row_error),
+        },
+    )
+
+
+@shared_cache("approximate_stats", show_spinner="Estimating statistics...")
+def approximate_stats(fingerprint, _df, _sketch=None):
+    #Reuses the sketch built during chunked ingestion when there is one.
+    sketch = _sketch if _sketch is not None else sketch_dataset(_df)
+    return sketch_stats(sketch, _df)
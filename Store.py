@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+import uuid
+from pathlib import Path
+
+import streamlit as st
+
+ARTIFACT_DIR = Path("outputs/artifacts")
+
+
+class ArtifactStore:
+    """Content-addressed store for rendered artifacts (images, HTML, bundles).
+
+    Keys are hashes of everything that determines an artifact, typically
+    the dataset fingerprint plus the rendering parameters, so every session
+    looking at the same data reuses the same files and nothing is
+    overwritten by another session. Like DatasetCache, the directory is kept
+    under `max_bytes` by evicting the least recently used files.
+    """
+
+    def __init__(self, directory=ARTIFACT_DIR, max_bytes=512 * 1024**2):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(*parts):
+        payload = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+    def path(self, key, suffix):
+        return self.directory / f"{key}{suffix}"
+
+    def __contains__(self, item):
+        return self.path(*item).exists()
+
+    def get(self, key, suffix):
+        path = self.path(key, suffix)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def put(self, key, suffix, data):
+        path = self.path(key, suffix)
+        # A private temp name per writer, two sessions rendering the same artifact just race to the same content.
+        tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        self.evict()
+        return path
+
+    def evict(self, keep=()):
+        #Files in `keep` still count towards max_bytes but are never deleted.
+        files = [(p, p.stat()) for p in self.directory.iterdir() if p.is_file() and not p.name.endswith(".tmp")]
+        total = sum(stat.st_size for _, stat in files)
+        for path, stat in sorted(files, key=lambda item: item[1].st_mtime):
+            if total <= self.max_bytes:
+                break
+            if path in keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= stat.st_size
+
+
+@st.cache_resource
+def artifact_store():
+    from Functions import setting
+    return ArtifactStore(max_bytes=int(setting("artifacts", "max_mb", 512) * 1024**2))
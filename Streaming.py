@@ -0,0 +1,120 @@
+import re
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import streamlit as st
+
+FENCE = "```"
+LIST_LINE = re.compile(r"([ \t]+\S|[ \t]*([-*+]|\d+[.)])([ \t]|$))")
+
+
+class CachedChunk(str):
+    """A whole response replayed from the response cache; drawn like a stream but not timed as one."""
+
+
+@dataclass
+class StreamStats:
+    """Timing of one streamed response; chunks are counted as tokens, Ollama sends one per chunk."""
+    ttft: float
+    tokens: int
+    seconds: float
+
+    @property
+    def tokens_per_second(self):
+        generating = self.seconds - self.ttft
+        return self.tokens / generating if generating > 0 else 0.0
+
+    def summary(self):
+        return f"First token {self.ttft:.2f}s · {self.tokens:,} tokens · {self.tokens_per_second:.1f} tokens/s"
+
+
+class StreamRenderer:
+    """Draws a streamed response with a bounded number of redraws.
+
+    Chunks are buffered and the screen is updated at most every `interval`
+    seconds or after `max_chars` new characters. Finished paragraphs (up to
+    a blank line outside a code fence or list) are committed to their own
+    element once; only the unfinished tail is ever redrawn, so a long response costs
+    about as much to send as its length instead of its length squared.
+    """
+
+    def __init__(self, container=None, interval=0.1, max_chars=400, show_stats=True):
+        self.container = container if container is not None else st.container()
+        self.interval = interval
+        self.max_chars = max_chars
+        self.show_stats = show_stats
+        self.stats = None
+
+    def _commit_point(self, tail):
+        #Last paragraph break with every code fence and list before it closed, 0 if there is none.
+        position = tail.rfind("\n\n")
+        while position > 0:
+            if not tail.count(FENCE, 0, position) % 2 and not self._inside_list(tail, position):
+                return position
+            position = tail.rfind("\n\n", 0, position)
+        return 0
+
+    @staticmethod
+    def _inside_list(tail, position):
+        # A blank line after a list item may separate items of a loose list; the list has only ended
+        # once the next complete line is neither an item nor indented.
+        if not LIST_LINE.match(tail[:position].rsplit("\n", 1)[-1]):
+            return False
+        following = tail[position:].lstrip("\n")
+        return "\n" not in following or bool(LIST_LINE.match(following.split("\n", 1)[0]))
+
+    def consume(self, chunks):
+        """Render `chunks` as they arrive and return the full text."""
+        start = time.monotonic()
+        first = None
+        parts, tail, pending, pending_chars, tokens, drawn = [], "", [], 0, 0, start
+        cached = False
+        slot = self.container.empty()
+        for chunk in chunks:
+            if not chunk:
+                continue
+            cached = cached or isinstance(chunk, CachedChunk)
+            now = time.monotonic()
+            if first is None:
+                first = now
+            tokens += 1
+            pending.append(chunk)
+            pending_chars += len(chunk)
+            if now - drawn < self.interval and pending_chars < self.max_chars:
+                continue
+            tail, slot = self._draw(tail + "".join(pending), slot, parts)
+            pending, pending_chars, drawn = [], 0, now
+        tail += "".join(pending)
+        if tail:
+            slot.markdown(tail)
+        parts.append(tail)
+        end = time.monotonic()
+        self.stats = StreamStats((first or end) - start, tokens, end - start)
+        # A cached reply arrives at once, counting it would drag the session's timing medians down.
+        if not cached:
+            record_stream(self.stats)
+        if self.show_stats:
+            self.container.caption("Answered from the response cache" if cached else self.stats.summary())
+        return "".join(parts)
+
+    def _draw(self, tail, slot, parts):
+        position = self._commit_point(tail)
+        if position:
+            # The finished paragraphs stay in this element, a fresh one below takes the tail.
+            slot.markdown(tail[:position])
+            parts.append(tail[:position])
+            tail, slot = tail[position:], self.container.empty()
+        slot.markdown(tail)
+        return tail, slot
+
+
+def record_stream(stats, keep=100):
+    #Per-session log of stream timings, shown in the sidebar.
+    try:
+        if "stream_stats" not in st.session_state:
+            st.session_state.stream_stats = deque(maxlen=keep)
+        st.session_state.stream_stats.append(stats)
+    except Exception:
+        # No session, e.g. when a cached function is run from a script.
+        pass
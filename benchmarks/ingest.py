@@ -0,0 +1,94 @@
+"""Compare the Loader fast-path readers with the plain pandas readers App.py used before.
+
+Run from the repository root:
+
+    python benchmarks/ingest.py --rows 1000000
+"""
+import argparse
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from Loader import read_dataset, read_excel_sheets  # noqa: E402
+
+
+def make_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "id": np.arange(rows),
+        "value": rng.normal(size=rows),
+        "amount": rng.integers(0, 10_000, size=rows),
+        "category": rng.choice(["north", "south", "east", "west"], size=rows),
+        "label": rng.choice([f"item_{i}" for i in range(500)], size=rows),
+    })
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def upload(path):
+    #Uploads reach the app as in-memory buffers, so benchmark against those too.
+    buffer = io.BytesIO(path.read_bytes())
+    buffer.name = path.name
+    return buffer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--excel-rows", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    df = make_frame(args.rows)
+    small = make_frame(args.excel_rows)
+    workdir = Path(tempfile.mkdtemp(prefix="zeno-bench-"))
+
+    csv_path = workdir / "data.csv"
+    tsv_path = workdir / "data.tsv"
+    jsonl_path = workdir / "data.jsonl"
+    parquet_path = workdir / "data.parquet"
+    excel_path = workdir / "data.xlsx"
+    df.to_csv(csv_path, index=False)
+    df.to_csv(tsv_path, index=False, sep="\t")
+    df.to_json(jsonl_path, orient="records", lines=True)
+    df.to_parquet(parquet_path, index=False)
+    with pd.ExcelWriter(excel_path) as writer:
+        for sheet in ["north", "south", "east", "west"]:
+            small.to_excel(writer, sheet_name=sheet, index=False)
+    sheets = ["north", "south", "east", "west"]
+
+    cases = [
+        ("csv", lambda: pd.read_csv(upload(csv_path)),
+         lambda: read_dataset(upload(csv_path), ".csv")),
+        ("tsv", lambda: pd.read_csv(upload(tsv_path), delimiter="\t"),
+         lambda: read_dataset(upload(tsv_path), ".tsv")),
+        ("jsonl", lambda: pd.read_json(upload(jsonl_path), lines=True),
+         lambda: read_dataset(upload(jsonl_path), ".jsonl")),
+        ("parquet (2 of 5 columns)", lambda: pd.read_parquet(upload(parquet_path))[["id", "value"]],
+         lambda: read_dataset(upload(parquet_path), ".parquet", columns=["id", "value"])),
+        ("xlsx (4 sheets)", lambda: pd.read_excel(upload(excel_path), sheet_name=None),
+         lambda: read_excel_sheets(upload(excel_path), sheets)),
+    ]
+
+    print(f"{'format':<26}{'pandas (s)':>12}{'fast path (s)':>15}{'speed-up':>10}")
+    for name, baseline, fast in cases:
+        before = timed(baseline, args.repeat)
+        after = timed(fast, args.repeat)
+        print(f"{name:<26}{before:>12.3f}{after:>15.3f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,82 +1,26 @@
 import streamlit as st
 import ollama
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import plotly.express as px
-import plotly.graph_objects as go
-import traceback
-import io
-import contextlib
-import uuid
-
-# --- Recorder class to persist st calls with unique keys for plotly charts ---
-class StreamlitCallRecorder:
-    def __init__(self):
-        self.calls = []
-        self.chart_counter = 0  # Counter for generating unique keys
-
-    def _record(self, method, *args, **kwargs):
-        # For plotly_chart, ensure a unique key is provided
-        if method == "plotly_chart" and "key" not in kwargs:
-            # Generate a unique key using chart counter
-            self.chart_counter += 1
-            kwargs["key"] = f"chart_{self.chart_counter}_{uuid.uuid4().hex[:8]}"
-        
-        self.calls.append((method, args, kwargs))
-
-    def write(self, *args, **kwargs): self._record("write", *args, **kwargs)
-    def dataframe(self, *args, **kwargs): self._record("dataframe", *args, **kwargs)
-    def table(self, *args, **kwargs): self._record("table", *args, **kwargs)
-    def plotly_chart(self, *args, **kwargs): self._record("plotly_chart", *args, **kwargs)
-    def markdown(self, *args, **kwargs): self._record("markdown", *args, **kwargs)
-    def json(self, *args, **kwargs): self._record("json", *args, **kwargs)
-    def line_chart(self, *args, **kwargs): self._record("line_chart", *args, **kwargs)
-    def bar_chart(self, *args, **kwargs): self._record("bar_chart", *args, **kwargs)
-    def area_chart(self, *args, **kwargs): self._record("area_chart", *args, **kwargs)
-
-    def get_calls(self):
-        return self.calls
-
-# --- Ollama streaming ---
-def stream_ollama(prompt):
-    for chunk in ollama.chat(
-        model="qwen2.5-coder:7b",
-        messages=[{"role": "user", "content": prompt}],
-        stream=True
-    ):
-        yield chunk["message"]["content"]
+from Functions import approximate_mode, code_cache, dataset_context, extract_code, setting, stream_ollama
+from History import chat_history
+from Sandbox import replay, sandbox_pool
+from Streaming import StreamRenderer
 
 # --- Execute bot code ---
 def execute(full_response):
-    output_buffer = io.StringIO()
-    recorder = StreamlitCallRecorder()
-    error = None
-
-    local_vars = {
-        "df": st.session_state.df,
-        "px": px,
-        "sns": sns,
-        "plt": plt,
-        "pd": pd,
-        "go": go,
-        "st": recorder  # Redirect all st.* calls to the recorder
-    }
-
-    try:
-        code = full_response.strip()[9:-3] if full_response.strip().startswith("```python") else full_response.strip()
-        with contextlib.redirect_stdout(output_buffer):
-            exec(code, {}, local_vars)
-    except Exception:
-        error = traceback.format_exc()
-
-    output_text = output_buffer.getvalue()
-    return code, output_text, recorder.get_calls(), error
+    # Runs in a sandbox worker process with CPU and memory limits; only the recorded st.* calls come back.
+    code = extract_code(full_response)
+    output_text, calls, error = sandbox_pool().run(st.session_state.fingerprint, st.session_state.df, code)
+    return code, output_text, calls, error
 
 # --- Prompt builder ---
 def get_response_stream(user_prompt):
-    prompt = f'''You are a data analyst assistant working on a with the following columns:
-{df.columns.tolist()}
+    # The dataset context comes first and is the one Overview sends, so Ollama reuses its cached prefix.
+    fingerprint = st.session_state.fingerprint
+    context = dataset_context(fingerprint, df, st.session_state.file.name, approximate_mode(fingerprint, len(df)))
+    prompt = f'''{context}
+
+You are a data analyst assistant working on the data set described above.
 The data frame is loaded in the variable df.
 You will be provided a question related to the data frame.
 Your task is to answer the question using Python code.
@@ -88,12 +32,7 @@ Respond only with executable Python code blocks that can run inside exec().
 Question:
 {user_prompt}
 '''
-    for chunk in ollama.chat(
-        model="qwen2.5-coder:7b",
-        messages=[{"role": "user", "content": prompt}],
-        stream=True
-    ):
-        yield chunk["message"]["content"]
+    yield from stream_ollama(prompt, model="qwen2.5-coder:7b")
 
 # --- Main App ---
 if "df" in st.session_state and st.session_state.df is not None:
@@ -106,27 +45,28 @@ if "df" in st.session_state and st.session_state.df is not None:
 
     if st.session_state.questions is None:
         from Functions import question
-        st.session_state.questions = question()
+        st.session_state.questions = question(st.session_state.file.name, df.columns.tolist())
         
-    questions = eval(st.session_state.questions)[:3]
+    questions = st.session_state.questions[:3]
     
     # Create buttons that set the session state variable
-    c1, c2, c3 = st.columns(3)
-    if c1.button(questions[0]):
-        st.session_state.button_question = questions[0]
-        st.rerun()
-    if c2.button(questions[1]):
-        st.session_state.button_question = questions[1]
-        st.rerun()
-    if c3.button(questions[2]):
-        st.session_state.button_question = questions[2]
+    for column, ques in zip(st.columns(3), questions):
+        if column.button(ques):
+            st.session_state.button_question = ques
+            st.rerun()
+
+    history = chat_history()
+    if "chat_window" not in st.session_state:
+        st.session_state.chat_window = setting("chat", "window", 20)
+
+    # Only the newest messages are rendered; older ones are decoded from the history store on request.
+    start = max(len(history) - st.session_state.chat_window, 0)
+    if start and st.button(f"Show earlier messages ({start} hidden)"):
+        st.session_state.chat_window += setting("chat", "window", 20)
         st.rerun()
 
-    if "messages" not in st.session_state:
-        st.session_state["messages"] = []
-
     # Show past messages
-    for msg_idx, msg in enumerate(st.session_state["messages"]):
+    for msg in history.records[start:]:
         with st.chat_message(msg["role"]):
             if msg["role"] == "user":
                 st.markdown(msg["content"])
@@ -136,16 +76,7 @@ if "df" in st.session_state and st.session_state.df is not None:
                 if msg.get("output"):
                     st.text("🧾 Output:")
                     st.code(msg["output"])
-                if msg.get("st_calls"):
-                    for call_idx, (method, args, kwargs) in enumerate(msg["st_calls"]):
-                        if hasattr(st, method):
-                            # Add unique key for plotly_chart if not present
-                            if method == "plotly_chart" and "key" not in kwargs:
-                                kwargs["key"] = f"msg_{msg_idx}_call_{call_idx}"
-                            try:
-                                getattr(st, method)(*args, **kwargs)
-                            except Exception as e:
-                                st.error(f"Error executing {method}: {str(e)}")
+                replay(history.calls(msg))
                 if msg.get("error"):
                     st.error(msg["error"])
 
@@ -159,47 +90,43 @@ if "df" in st.session_state and st.session_state.df is not None:
     
     # Process input if available
     if user_input:
-        st.session_state["messages"].append({"role": "user", "content": user_input})
+        history.add_user(user_input)
 
         with st.chat_message("user"):
             st.markdown(user_input)
         
-        with st.chat_message("assistant"):
-            response_container = st.empty()
-            full_response = ""
+        # Questions already answered about a dataset of the same schema reuse their working code.
+        cache = code_cache()
+        schema = cache.schema_key(df)
+        cached = cache.get(schema, user_input, df.columns)
 
-            for chunk in get_response_stream(user_input):
-                full_response += chunk
-                with st.expander("show code", expanded=False):
-                    response_container.markdown(full_response)
+        with st.chat_message("assistant"):
+            # The expander is created once; the renderer only redraws the unfinished part of the reply.
+            with st.expander("show code", expanded=False):
+                if cached is not None:
+                    full_response = f"```python\n{cached[0]}\n```"
+                    st.markdown(full_response)
+                else:
+                    full_response = StreamRenderer().consume(get_response_stream(user_input))
+            if cached is not None:
+                st.caption(f"Reused code from a similar question (similarity {cached[1]:.2f})")
 
             # Execute the response as soon as it's fully streamed
             code, output, st_calls, error = execute(full_response)
+            if cached is None and error is None:
+                cache.put(schema, user_input, code, df.columns)
+            elif cached is not None and error is not None:
+                cache.forget(schema, cached[0])
 
             if output:
                 st.text("🧾 Output:")
                 st.markdown(output)
-            if st_calls:
-                for call_idx, (method, args, kwargs) in enumerate(st_calls):
-                    if hasattr(st, method):
-                        # Add additional unique key when showing in the UI
-                        if method == "plotly_chart" and "key" not in kwargs:
-                            kwargs["key"] = f"current_response_call_{call_idx}"
-                        try:
-                            getattr(st, method)(*args, **kwargs)
-                        except Exception as e:
-                            st.error(f"Error executing {method}: {str(e)}")
+            replay(st_calls)
             if error:
                 st.error(error)
 
-            st.session_state["messages"].append({
-                "role": "assistant",
-                "content": full_response,
-                "code": code,
-                "output": output,
-                "st_calls": st_calls,
-                "error": error
-            })
+            # Recorded calls are serialized once here; figures and frames are not kept as live objects.
+            history.add_assistant(full_response, code, output, st_calls, error)
 else:
     st.markdown(f'''
 ### 🤖 Chat with Your Data
@@ -2,7 +2,11 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-import io
+from Correlation import heatmap_matrix
+from Exports import session_exports
+from Functions import setting
+from Plots import (bar_sums, box_figure, box_stats, downsampled_lines, histogram_trace, large_scatter,
+                   zoom_slider)
 
 if "df" in st.session_state and st.session_state.df is not None:
     df = st.session_state.df
@@ -13,7 +17,7 @@ if "df" in st.session_state and st.session_state.df is not None:
         ["Scatter Plot", "Line Plot", "Bar Chart", "Histogram", "Box Plot", "Heatmap", "Pie Chart"]
     )
 
-    numeric_cols = df.select_dtypes(include=['float64', 'int64']).columns.tolist()
+    numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
     all_cols = df.columns.tolist()
     
     # Main plotting area
@@ -24,26 +28,52 @@ if "df" in st.session_state and st.session_state.df is not None:
         x_col = st1.selectbox("Select X-axis column", all_cols)
         y_col = st2.selectbox("Select Y-axis column", numeric_cols)
         color_col = st3.selectbox("Select color column (optional)", ["None"] + all_cols)
+        max_points = setting("plots", "scatter_points", 200_000)
+        if len(df) > max_points:
+            render_mode = st.radio("Large data rendering", ["WebGL sample", "Density"], horizontal=True,
+                                   help="Send a stratified sample drawn with WebGL, or bin the points on the server")
         
         if st.button("Generate Scatter Plot"):
             st.subheader("Scatter Plot")
-            if color_col == "None":
+            if len(df) > max_points:
+                fig, sent, unit = large_scatter(st.session_state.fingerprint, df, x_col, y_col,
+                                          None if color_col == "None" else color_col, render_mode, max_points)
+                st.caption(f"Sent {sent:,} {unit} for {len(df):,} rows.")
+            elif color_col == "None":
                 fig = px.scatter(df, x=x_col, y=y_col, title=f"{y_col} vs {x_col}")
             else:
                 fig = px.scatter(df, x=x_col, y=y_col, color=color_col, title=f"{y_col} vs {x_col} colored by {color_col}")
+            if len(df) <= max_points:
+                st.caption(f"Sent all {len(df):,} points.")
             st.plotly_chart(fig, use_container_width=True)
     
     elif plot_type == "Line Plot":
         st1, st2= st.columns([1, 1])
         x_col = st1.selectbox("Select X-axis column", all_cols)
         y_cols = st2.multiselect("Select Y-axis column(s)", numeric_cols)
+        max_points = setting("plots", "line_points", 2000)
+        large = len(df) > max_points
+        if large:
+            methods = ["Min/max", "LTTB"] + (["Resample mean"] if pd.api.types.is_datetime64_any_dtype(df[x_col]) else [])
+            method = st.radio("Downsampling", methods, horizontal=True,
+                              help="Every series is cut down to about as many points as the chart has pixels")
         
-        if st.button("Generate Line Plot"):
+        generate = st.button("Generate Line Plot")
+        if generate and large:
+            # Remembered so the plot survives the reruns triggered by zooming.
+            st.session_state.line_plot = (x_col, tuple(y_cols))
+        if generate or (large and st.session_state.get("line_plot") == (x_col, tuple(y_cols))):
             if y_cols:
                 st.subheader("Line Plot")
-                fig = go.Figure()
-                for y_col in y_cols:
-                    fig.add_trace(go.Scatter(x=df[x_col], y=df[y_col], mode='lines', name=y_col))
+                if large:
+                    x_range = zoom_slider(df, x_col)
+                    fig, sent = downsampled_lines(st.session_state.fingerprint, df, x_col, y_cols, x_range,
+                                                  max_points, method)
+                    st.caption(f"Sent {sent:,} points for {len(y_cols)} series of {len(df):,} rows.")
+                else:
+                    fig = go.Figure()
+                    for y_col in y_cols:
+                        fig.add_trace(go.Scatter(x=df[x_col], y=df[y_col], mode='lines', name=y_col))
                 fig.update_layout(title=f"Line Plot of {', '.join(y_cols)} vs {x_col}")
                 st.plotly_chart(fig, use_container_width=True)
             else:
@@ -58,9 +88,9 @@ if "df" in st.session_state and st.session_state.df is not None:
         if st.button("Generate Bar Chart"):
             st.subheader("Bar Chart")
             if orientation == "Vertical":
-                fig = px.bar(df, x=x_col, y=y_col, title=f"Bar Chart of {y_col} vs {x_col}")
+                fig = px.bar(bar_sums(df, x_col, y_col), x=x_col, y=y_col, title=f"Bar Chart of {y_col} vs {x_col}")
             else:
-                fig = px.bar(df, y=x_col, x=y_col, title=f"Bar Chart of {y_col} vs {x_col}", orientation='h')
+                fig = px.bar(bar_sums(df, x_col, y_col), y=x_col, x=y_col, title=f"Bar Chart of {y_col} vs {x_col}", orientation='h')
             st.plotly_chart(fig, use_container_width=True)
     
     elif plot_type == "Histogram":
@@ -70,7 +100,8 @@ if "df" in st.session_state and st.session_state.df is not None:
         
         if st.button("Generate Histogram"):
             st.subheader("Histogram")
-            fig = px.histogram(df, x=hist_col, nbins=bins, title=f"Histogram of {hist_col}")
+            fig = go.Figure(histogram_trace(df[hist_col], bins))
+            fig.update_layout(title=f"Histogram of {hist_col}", xaxis_title=hist_col, yaxis_title="count", bargap=0)
             st.plotly_chart(fig, use_container_width=True)
     
     elif plot_type == "Box Plot":
@@ -81,9 +112,10 @@ if "df" in st.session_state and st.session_state.df is not None:
         if st.button("Generate Box Plot"):
             st.subheader("Box Plot")
             if x_col == "None":
-                fig = px.box(df, y=y_col, title=f"Box Plot of {y_col}")
+                fig = box_figure(*box_stats(df[y_col]), title=f"Box Plot of {y_col}")
             else:
-                fig = px.box(df, x=x_col, y=y_col, title=f"Box Plot of {y_col} grouped by {x_col}")
+                fig = box_figure(*box_stats(df[y_col], df[x_col]), title=f"Box Plot of {y_col} grouped by {x_col}")
+                fig.update_layout(xaxis_title=x_col, yaxis_title=y_col)
             st.plotly_chart(fig, use_container_width=True)
     
     elif plot_type == "Heatmap":
@@ -91,12 +123,14 @@ if "df" in st.session_state and st.session_state.df is not None:
         
         if st.button("Generate Heatmap"):
             st.subheader("Correlation Heatmap")
-            # Calculate correlation matrix
-            corr_df = df[numeric_cols].corr(method=corr_method)
+            # Clustered matrix, reduced to the columns of the strongest pairs on wide tables
+            corr_df, total = heatmap_matrix(st.session_state.fingerprint, df, corr_method)
+            if len(corr_df) < total:
+                st.caption(f"Showing {len(corr_df)} of {total} numeric columns, those in the strongest pairs.")
             
             fig = px.imshow(
                 corr_df,
-                text_auto=True,
+                text_auto=".2f" if len(corr_df) <= 15 else False,
                 color_continuous_scale="RdBu_r",
                 title=f"{corr_method.capitalize()} Correlation Heatmap"
             )
@@ -113,22 +147,27 @@ if "df" in st.session_state and st.session_state.df is not None:
             if len(df[label_col].unique()) > 10:
                 st.warning(f"Many unique values in {label_col} (>{len(df[label_col].unique())}). Consider using a different column.")
             
-            grouped_data = df.groupby(label_col)[value_col].sum().reset_index()
+            grouped_data = df.groupby(label_col, observed=True)[value_col].sum().reset_index()
             fig = px.pie(grouped_data, names=label_col, values=value_col, title=f"Pie Chart of {value_col} by {label_col}")
             st.plotly_chart(fig, use_container_width=True)
     
-    # Download plotly figure as HTML
+    # The latest figure is kept, and only written and gzipped in the session's export folder when downloaded
     if "fig" in locals():
-        buffer = io.StringIO()
-        fig.write_html(buffer)
-        html_bytes = buffer.getvalue().encode()
-        
-        st.download_button(
-            label="Download Plot as HTML",
-            data=html_bytes,
-            file_name=f"{plot_type.lower().replace(' ', '_')}.html",
-            mime="text/html"
-        )
+        st.session_state.plot_export = (f"{plot_type.lower().replace(' ', '_')}.html", fig)
+
+    @st.dialog("Download Plot")
+    def download_plot(name, fig):
+        exports = session_exports()
+        with open(exports.gzipped(exports.add_figure(name, fig)), "rb") as compressed:
+            st.download_button(
+                label="Download Plot as HTML",
+                data=compressed,
+                file_name=f"{name}.gz",
+                mime="application/gzip"
+            )
+
+    if "plot_export" in st.session_state and st.button("Download Plot", icon="📥"):
+        download_plot(*st.session_state.plot_export)
 else:
     st.markdown(f'''
                 ### 📊 Interactive Graph Builder
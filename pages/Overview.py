@@ -1,102 +1,64 @@
 import streamlit as st
-@st.cache_data
-def callOllama(prompt, model="gemma3"):
-    #Call the Ollama API with the given prompt.
-    response = ollama.chat(
-        model=model,
-        messages=[{'role': 'user', 'content': prompt}]
-    )
-    return response.get('message', {}).get('content', "No response.")
-
-def stream_ollama(prompt, model="gemma3"):
-    for chunk in ollama.chat(
-        model=model,
-        messages=[{"role": "user", "content": prompt}],
-        stream=True
-    ):
-        yield chunk["message"]["content"]
-
-@st.cache_data
-def plot_pairplot(df):
-    pp = sns.pairplot(df, height=3)
-    pp.savefig("outputs/pairplot.png")
-    return "outputs/pairplot.png"
+from concurrent.futures import FIRST_COMPLETED, wait
+from Functions import (CODE_ANSWERS_SCHEMA, callOllama, extract_code, parse_code_answers, stream_ollama,
+                       submit_ollama)
+from Streaming import StreamRenderer
 
 @st.cache_data
 def analyze_data(context):
-    prompt = f"""The following statistics were extracted from a data set, summarise this info in bullet points.
-    Only reply in bullet points:
-    {context}"""
+    prompt = f"""{context}
+
+    The statistics above were extracted from a data set, summarise this info in bullet points.
+    Only reply in bullet points."""
     # response = callOllama(prompt, model="gemma3"
     # return response
-    container = st.empty()
-    response = ""
-    for chunk in stream_ollama(prompt, model="gemma3"):
-        response += chunk
-        container.markdown(response)
+    StreamRenderer().consume(stream_ollama(prompt, model="gemma3"))
 
-@st.cache_data
-def analyze_correlation(file_name, corr):
-    prompt = f"""Summarize the observations from the correlation data in bullet points. First list columns
+def analyze_correlation(context, correlations):
+    #Returns a Future so the summary can be generated while the rest of the page renders.
+    pairs = correlation_context(correlations.pairs(), setting("context", "correlation_tokens", 400))
+    prompt = f"""{context}
+
+    Summarize the observations from the correlation data in bullet points. First list columns
     with high correlation, then list columns with low correlation.
     Only reply in bullet points:
-    File Name: {file_name}
-    Correlation Data:
-    {corr}"""
-    response = callOllama(prompt, model="qwen2.5-coder:7b")
-    return response
-@st.cache_data
-def question():
-    prompt = f"""Based on the following info extracted from a data set, write intersting questions 
-    a data analyst can plot, present your output only in the following format:
-    ['Question1', 'Question2', 'Question3']
-    also do not use apostropes in the output.
-    eg: ['What is the average age of customers?', 'How many unique products are sold?']
-    
-    Data Name: {file_name}
-    Columns: {columns} """
-    response = callOllama(prompt, model="gemma3")
-    return response
-
-def get_context(uploaded_file, df):
-    file_name = uploaded_file.name
-    columns = df.columns.tolist()
-    numerical_columns = df.select_dtypes(include=['number']).columns.tolist()
-    categorical_columns = df.select_dtypes(exclude=['number']).columns.tolist()
-    categorised_data = {'Numerical': numerical_columns, 'Categorical': categorical_columns}
-    return f"""
-    Dataset File Name: {file_name}
-
-    Initial Preview (First 3 Rows of DataFrame):
-    {df.head(3)}
-
-    Columns of the DataFrame:
-    {df.columns.tolist()}
+    {pairs}"""
+    return submit_ollama(prompt, model="qwen2.5-coder:7b")
 
-    Columns categorised as Numerical and Categorical:
-    {categorised_data}
+# Every qwen prompt opens with the same dataset context, so Ollama can reuse its cached prefix.
+def code_prompt(context, ques):
+    return f'''{context}
 
-    Statistical Summary of Numerical Columns:
-    {df.describe()}
+        Answer the following question using only code snippets. The dataset above is called `df`.
+        The code should be written in Python using plotly express and should be compatible with Streamlit.
+        Reply only with the code and nothing else. Do not import anything. Do not write
+        comments.Do not use streamlit headers or any text only do the plots..
 
-    Data Types for Each Column:
-    {df.dtypes}
+        The question is: 
+        {ques}
+        write the question using st.subheader() and then plot the graph using st.plotly_chart()
+        '''
 
-    Dimensions of the Dataset (Rows, Columns):
-    {df.shape}
+def batch_code_prompt(context, questions):
+    #All questions in one structured request, the dataset context is only sent once.
+    numbered = "\n".join(f"{index}. {ques}" for index, ques in enumerate(questions))
+    return f'''{context}
 
-    Count of Missing (Null) Values in Each Column:
-    {df.isnull().sum()}
+        Answer each of the following questions using only code snippets. The dataset above is called `df`.
+        The code should be written in Python using plotly express and should be compatible with Streamlit.
+        Do not import anything. Do not write comments. Do not use streamlit headers or any text only do the plots.
+        Do not wrap the code in markdown fences.
 
-    Count of Unique Values per Column:
-    {df.nunique()}
+        For every question write the question using st.subheader() and then plot the graph using st.plotly_chart().
+        Reply with a JSON object whose "answers" list has one entry per question with its index and its code.
 
-    Frequency Distribution of Unique Values (Value Counts):
-    {df.value_counts()}
+        The questions are:
+        {numbered}
+        '''
 
-    Total Number of Duplicate Rows in the DataFrame:
-    {df.duplicated().sum()}
-    """
+def run_chart(code):
+    #Generated code runs in a sandbox worker, charts of several questions are computed in parallel.
+    return sandbox_pool().submit(fingerprint, df, extract_code(code))
 
 
 if st.session_state.df is not None:
@@ -106,29 +68,67 @@ if st.session_state.df is not None:
     import seaborn as sns
     import plotly.express as px
     import plotly.express as px
+    from Context import correlation_context
+    from Correlation import correlation_result, heatmap_matrix
+    from Functions import approximate_mode, code_cache, dataset_context, dataset_summary, setting
+    from Plots import column_boxes, pairplot_grid
+    from Sandbox import replay, sandbox_pool
+    from Store import artifact_store
     
 if st.session_state.file is not None:
     uploaded_file = st.session_state.file 
 
     file_name = uploaded_file.name
     columns = df.columns.tolist()
-    context = get_context(uploaded_file, df)
+    fingerprint = st.session_state.fingerprint
+    approximate = st.toggle("Approximate statistics", value=approximate_mode(fingerprint, len(df)),
+                            help="Estimate distinct counts, quartiles and top values from mergeable sketches")
+    # The chatbot describes the dataset in the same mode, so both pages send the same prompt prefix.
+    st.session_state.stats_mode = (fingerprint, approximate)
+    stats, outliers = dataset_summary(fingerprint, df, approximate)
+    context = dataset_context(fingerprint, df, file_name, approximate)
 
 
     st.write("### Data Preview")
     if st.checkbox('DataFrame preview:', value=True):
         st.write(df)
-    
+
+    rows, cols, missing, dups = st.columns(4)
+    rows.metric("Rows", f"{stats.shape[0]:,}")
+    cols.metric("Columns", f"{stats.shape[1]:,}")
+    missing.metric("Missing cells", f"{int(stats.columns['nulls'].sum()):,}")
+    dups.metric("Duplicate rows", stats.duplicates())
+    with st.expander("Column summary"):
+        st.dataframe(stats.summary())
+        if stats.error_bounds:
+            st.caption(stats.approximation_note())
+
+    # Start every code generation now; they run in the background while the summary streams.
+    if st.session_state.questions is None:
+        from Functions import question
+        st.session_state.questions = question(file_name, columns)
+    questions = st.session_state.questions
+    batch = setting("ollama", "batch_codegen", True) and len(questions) > 1
+    if batch:
+        batch_future = submit_ollama(batch_code_prompt(context, questions), model="qwen2.5-coder:7b",
+                                     format=CODE_ANSWERS_SCHEMA)
+        code_futures = {}
+    else:
+        code_futures = {submit_ollama(code_prompt(context, ques), model="qwen2.5-coder:7b"): index
+                        for index, ques in enumerate(questions)}
+    correlations = correlation_result(fingerprint, df)
+    corr_future = analyze_correlation(context, correlations) if len(correlations.columns) > 1 else None
 
     st.subheader("Dataset Summary")
     st.write(analyze_data(context))
 
     try:
-        corr = df.corr()
+        # Wide tables are reduced to the columns of the strongest pairs, clustered so related ones sit together.
+        corr, total = heatmap_matrix(fingerprint, df)
         fig, ax = plt.subplots(figsize=(10, 8))
         sns.heatmap(
             corr, 
-            annot=True, 
+            annot=len(corr) <= 15, 
             fmt=".2f", 
             cmap="RdBu_r", 
             cbar_kws={"label": "Correlation"}, 
@@ -138,17 +138,15 @@ if st.session_state.file is not None:
         left, right = st.columns(2)
         st.subheader("Correlation Matrix")
         left.pyplot(fig)
-        right.write(analyze_correlation(file_name, corr))
+        if len(corr) < total:
+            left.caption(f"Showing {len(corr)} of {total} numeric columns.")
+        right.write(corr_future.result())
     except Exception as e:
         pass
 
     try:    
-        numeric_df = df.select_dtypes(include=['number'])  # Filter only numeric columns
-        fig = px.box(
-        numeric_df,
-        points="all",  # Show all points (outliers)
-        title="Boxplot of Numeric Values",
-        )
+        # Quartiles, whiskers and only the outlying points are computed here instead of shipping every value.
+        fig = column_boxes(fingerprint, df)
         fig.update_layout(
             xaxis_title="Columns",
             yaxis_title="Values",
@@ -159,40 +157,78 @@ if st.session_state.file is not None:
     except Exception as e:
         pass
 
+    if not outliers.columns.empty:
+        flagged, share, columns_hit = st.columns(3)
+        flagged.metric("Rows with outliers", f"{outliers.flagged_rows:,}")
+        share.metric("Share of rows", f"{outliers.flagged_rows / max(outliers.total_rows, 1):.2%}")
+        columns_hit.metric("Columns affected", f"{int((outliers.columns['flagged'] > 0).sum()):,}")
+        st.caption("A value is flagged when at least two of IQR fences, robust z-score (MAD) and isolation score agree.")
+        with st.expander("Outliers per column"):
+            st.dataframe(outliers.columns)
+        with st.expander("Most extreme rows"):
+            st.dataframe(outliers.rows)
+
     try:    
-        if len(df.select_dtypes(include=['number']).columns) < 7:
-            image_path = plot_pairplot(df)
-            st.image(image_path, caption="Pairplot")
+        numeric_columns = stats.numerical_columns
+        if len(numeric_columns) > 1:
+            st.subheader("Pairplot")
+            # Any number of columns can be chosen, panels are rendered one at a time and stored by content.
+            chosen = st.multiselect("Pairplot columns", numeric_columns, default=numeric_columns[:6])
+            pairplot_grid(fingerprint, df, chosen, artifact_store())
     except Exception as e:
         pass
     
-    if st.session_state.questions is None:
-        from Functions import question
-        st.session_state.questions = question()
-    questions = eval(st.session_state.questions)
-
-    for ques in questions:
-
-        prompt = f'''
-        Answer the following question using only code snippets.The dataset is called `df` and has the following columns:
-        {", ".join(columns)}
-        The code should be written in Python using plotly express and should be compatible with Streamlit.
-        Reply only with the code and nothing else. Do not import anything. Do not write
-        comments.Do not use streamlit headers or any text only do the plots..
-        The data types of the columns are: {df.dtypes.to_dict()}
-
-        The question is: 
-        {ques}
-        write the question using st.subheader() and then plot the graph using st.plotly_chart()
-        '''
-
-        code = callOllama(prompt, model="qwen2.5-coder:7b")
-
+    # One placeholder per question keeps the charts in order while they arrive in any order.
+    slots = [st.empty() for _ in questions]
+    charts = {}
+    # Answers replayed from the response cache were already offered to the code cache when they were generated.
+    fresh = set()
+    if batch:
         try:
-            exec(code[9:len(code)-3], globals())
+            codes = parse_code_answers(batch_future.result(), len(questions))
         except Exception as e:
-            pass
-        
+            codes = [None] * len(questions)
+        for index, code in enumerate(codes):
+            if code is None:
+                # Only answers that failed validation are asked for again, one by one.
+                code_futures[submit_ollama(code_prompt(context, questions[index]),
+                                           model="qwen2.5-coder:7b")] = index
+            else:
+                charts[run_chart(code)] = (index, code)
+                if not batch_future.cached:
+                    fresh.add(index)
+    cache, schema = code_cache(), code_cache().schema_key(df)
+
+    def show(future):
+        # Whatever a snippet drew before failing is still shown, errors are not.
+        index, code = charts.pop(future)
+        _, calls, error = sandbox_pool().result(future)
+        with slots[index].container():
+            replay(calls)
+        if error is None and index in fresh:
+            # Working answers seed the chatbot's code cache, its suggested questions are these same questions.
+            cache.put(schema, questions[index], extract_code(code), df.columns)
+
+    # Code answers and charts are handled in whatever order they finish, each chart is drawn as soon as it is ready.
+    pending = set(code_futures) | set(charts)
+    while pending:
+        done, pending = wait(pending, timeout=sandbox_pool().timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            # Snippets still running after the timeout, result() stops them and reports it.
+            done = pending & charts.keys()
+            pending -= done
+        for future in done:
+            if future in charts:
+                show(future)
+                continue
+            try:
+                chart = run_chart(future.result())
+                charts[chart] = (code_futures[future], future.result())
+                pending.add(chart)
+                if not future.cached:
+                    fresh.add(code_futures[future])
+            except Exception as e:
+                pass
     
 
 else:
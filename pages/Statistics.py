@@ -1,39 +1,74 @@
 import streamlit as st
+import streamlit.components.v1 as components
 
 
-if 'report' not in st.session_state:
-    st.session_state.report = None
+@st.fragment(run_every=1)
+def profile_progress(jobs, key):
+    # Polls the background profiler and reruns the page once the report is on disk.
+    state, progress, message = jobs.status(key)
+    if state != "running":
+        st.rerun()
+    st.progress(progress, text=message)
 
 def generate_report(df):
-    if st.session_state.report is not None:
-        st_profile_report(st.session_state.report)
-    else:
-        st.session_state.report = df.profile_report()
-        st_profile_report(st.session_state.report)
+    fingerprint = st.session_state.fingerprint
+    large = len(df) > setting("profiling", "sample_rows", 100_000)
+    with st.expander("Report settings"):
+        columns = st.multiselect("Columns", df.columns.tolist(), default=df.columns.tolist())
+        minimal = st.toggle("Minimal report", value=large,
+                            help="Skips correlations, interactions and other expensive sections")
+        sampled = st.toggle("Profile a sample", value=large)
+        sample_rows = st.number_input("Sample rows", min_value=1_000, step=10_000,
+                                      value=setting("profiling", "sample_rows", 100_000), disabled=not sampled)
+    config = profile_config(df, columns or None, minimal, sample_rows if sampled else None)
 
-    st.session_state.report.to_file("outputs/report.html")
+    jobs = profile_jobs()
+    key = jobs.key(fingerprint, config)
+    state, _, message = jobs.status(key)
+    if state == "missing":
+        jobs.submit(fingerprint, df, config, title=st.session_state.file.name)
+        state = "running"
+    if state == "failed":
+        st.error(f"Error generating report: {message}")
+        if st.button("Retry"):
+            jobs.submit(fingerprint, df, config, title=st.session_state.file.name)
+            st.rerun()
+        return None
+    if state == "running":
+        profile_progress(jobs, key)
+        return None
+    path = jobs.report(key)
+    # One copy of the report text in memory however many sessions are viewing it.
+    html = shared_store().get(("profile_html", key), lambda: path.read_text(encoding="utf-8"), session_id())
+    components.html(html, height=1000, scrolling=True)
+    return path
 
 
 if "df" in st.session_state and st.session_state.df is not None:
     df = st.session_state.df
-    from ydata_profiling import ProfileReport
-    from streamlit_pandas_profiling import st_profile_report
     from streamlit_extras.floating_button import floating_button
-    generate_report(df)
+    from Functions import setting
+    from Exports import session_exports
+    from Profiling import profile_config, profile_jobs
+    from Shared import session_id, shared_store
+    report_path = generate_report(df)
     try:
         @st.dialog("Download Report")
         def download_report():
-            st.download_button(
-                label="Download Report",
-                data=open("outputs/report.html", "r+"),
-                file_name="report.html",
-                mime="text/html"
-            )
+            # The session's copy is a hard link to the stored report, only its gzip is read for the download.
+            exported = session_exports().add_file("profile_report.html", report_path)
+            with open(session_exports().gzipped(exported), "rb") as report:
+                st.download_button(
+                    label="Download Report",
+                    data=report,
+                    file_name="profile_report.html.gz",
+                    mime="application/gzip"
+                )
 
     except Exception as e:
         st.error(f"Error generating report: {e}")
 
-    if floating_button("Download Report", icon="📥"):
+    if report_path is not None and floating_button("Download Report", icon="📥"):
         download_report()
 
 else:
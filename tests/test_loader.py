@@ -0,0 +1,36 @@
+import io
+import sys
+import types
+
+import pandas as pd
+
+import Loader
+
+
+def test_excel_workers_do_not_run_the_page(tmp_path, monkeypatch):
+    # Streamlit runs the page as __main__; a spawned worker that imported it would run the whole app again.
+    marker = tmp_path / "page_ran"
+    page = tmp_path / "App.py"
+    page.write_text(f"open({str(marker)!r}, 'w').close()\n")
+    main = types.ModuleType("__main__")
+    main.__file__ = str(page)
+    monkeypatch.setitem(sys.modules, "__main__", main)
+    monkeypatch.setattr(Loader.os, "cpu_count", lambda: 2)
+
+    workbook = io.BytesIO()
+    with pd.ExcelWriter(workbook) as writer:
+        pd.DataFrame({"a": [1, 2]}).to_excel(writer, sheet_name="first", index=False)
+        pd.DataFrame({"b": [3, 4]}).to_excel(writer, sheet_name="second", index=False)
+
+    frames = Loader.read_excel_sheets(workbook, ["first", "second"])
+
+    assert frames["first"]["a"].tolist() == [1, 2]
+    assert frames["second"]["b"].tolist() == [3, 4]
+    assert not marker.exists()
+
+
+def test_csv_missing_text_matches_pandas():
+    data = b"name,city,n\nann,NYC,1\n,NA,2\nNA,LA,\nbob,,4\n"
+    fast = Loader.read_dataset(io.BytesIO(data), ".csv")
+    expected = pd.read_csv(io.BytesIO(data))
+    assert fast.isna().sum().tolist() == expected.isna().sum().tolist()
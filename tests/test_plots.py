@@ -0,0 +1,13 @@
+import numpy as np
+import pandas as pd
+
+from Plots import LinePyramid, _resample
+
+
+def test_resample_of_only_gaps_is_an_empty_trace():
+    x = pd.date_range("2024-01-01", periods=4, freq="h").to_numpy().astype(np.int64)
+    pyramid = LinePyramid(x, np.array([1.0, np.nan, np.nan, 4.0]), "datetime")
+    xs, ys = _resample(pyramid, 1, 3, 10)
+    assert len(xs) == 0 and len(ys) == 0
+    xs, ys = _resample(pyramid, 0, 4, 10)
+    assert list(ys) == [1.0, 4.0]
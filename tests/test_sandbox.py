@@ -0,0 +1,26 @@
+import os
+
+import pandas as pd
+
+from Loader import evict_files
+from Sandbox import _execute
+
+
+def test_snippet_functions_see_snippet_names(tmp_path):
+    path = tmp_path / "data.pkl"
+    pd.DataFrame({"x": [1, 2, 3]}).to_pickle(path)
+    code = "scale = 10\ndef scaled(v):\n    return v * scale\nprint([scaled(v) for v in df['x']])"
+    stdout, _, error = _execute(str(path), code, 30, 2 * 1024**3)
+    assert error is None
+    assert stdout.strip() == "[10, 20, 30]"
+
+
+def test_evict_files_drops_the_oldest_but_keep(tmp_path):
+    paths = []
+    for age, name in enumerate(["old", "mid", "new"]):
+        path = tmp_path / f"{name}.pkl"
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (age, age))
+        paths.append(path)
+    evict_files(tmp_path.glob("*.pkl"), 200, keep=paths[0])
+    assert sorted(p.name for p in tmp_path.glob("*.pkl")) == ["new.pkl", "old.pkl"]
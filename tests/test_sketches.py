@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+from Sketches import DatasetSketch
+
+
+def test_text_in_a_later_chunk_counts_as_missing():
+    sketch = DatasetSketch().update(pd.DataFrame({"x": [1.0, 2.0]}))
+    sketch.update(pd.DataFrame({"x": ["3", "n/a"]}))
+    column = sketch.columns["x"]
+    assert (column.count, column.nulls) == (3, 1)
+    assert column.mean == 2.0
+
+
+def test_variance_survives_a_large_offset():
+    values = 1.7e9 + np.random.default_rng(0).random(100_000)
+    sketch = DatasetSketch()
+    for chunk in np.array_split(values, 7):
+        sketch.merge(DatasetSketch().update(pd.DataFrame({"x": chunk})))
+    assert np.isclose(np.sqrt(sketch.columns["x"].variance), values.std(ddof=1), rtol=1e-6)
+
+
+def test_merged_row_positions_follow_earlier_chunks():
+    df = pd.DataFrame({"x": [1, 2, 3, 4, 5, 9, 9, 9]})
+    sketch = DatasetSketch().update(df.iloc[:5]).merge(DatasetSketch().update(df.iloc[5:]))
+    position, count = sketch.frequent_rows.top_values(1)[0]
+    assert df.iloc[position]["x"] == 9 and count == 3